@@ -0,0 +1,37 @@
+import asyncio
+
+# Сбор альбомов (media group). Telegram присылает каждое фото альбома отдельным сообщением
+# с общим media_group_id. Первое сообщение ждёт остальные, пока они приходят не реже чем
+# раз в ALBUM_WAIT_SECONDS, и проверяется вместе с ними как одно объявление; обработчики
+# остальных сообщений альбома ничего не делают.
+ALBUM_WAIT_SECONDS = 1.0
+
+_albums = {}  # (chat_id, media_group_id) -> _Album
+
+
+class _Album:
+    def __init__(self, message):
+        self.messages = [message]
+        self.updated = asyncio.get_running_loop().time()
+
+
+async def collect(message):
+    """Возвращает все сообщения альбома по порядку, если message — первое из них, иначе None."""
+    loop = asyncio.get_running_loop()
+    key = (message.chat.id, message.media_group_id)
+    album = _albums.get(key)
+    if album is not None:
+        album.messages.append(message)
+        album.updated = loop.time()
+        return None
+
+    album = _albums[key] = _Album(message)
+    try:
+        while True:
+            delay = album.updated + ALBUM_WAIT_SECONDS - loop.time()
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+    finally:
+        del _albums[key]
+    return sorted(album.messages, key=lambda album_message: album_message.message_id)
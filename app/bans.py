@@ -0,0 +1,140 @@
+import asyncio
+import functools
+import heapq
+import logging
+import time
+from aiogram import types
+from config import ADMIN_IDS, bot
+from app import storage, outbox, metrics
+
+logger = logging.getLogger(__name__)
+
+# Планировщик окончания блокировок: куча (min-heap) сроков окончания, одна задача спит до
+# ближайшего срока. Добавление и снятие блокировки — O(log n), без периодического просмотра таблицы.
+# Устаревшие записи кучи (блокировку сняли или продлили) пропускаются при извлечении.
+_heap = []  # (banned_until, chat_id, user_id)
+_deadlines = {}  # (chat_id, user_id) -> (banned_until, first_name), актуальный срок временной блокировки
+_wakeup = None
+_task = None
+_on_expire = None
+
+
+def _schedule(chat_id: int, user_id: int, first_name: str, banned_until: int):
+    if banned_until == 0:
+        # Бессрочная блокировка отменяет запланированное окончание
+        _deadlines.pop((chat_id, user_id), None)
+        return
+    _deadlines[(chat_id, user_id)] = (banned_until, first_name)
+    heapq.heappush(_heap, (banned_until, chat_id, user_id))
+    if _wakeup is not None and _heap[0] == (banned_until, chat_id, user_id):
+        _wakeup.set()
+
+
+async def _run():
+    while True:
+        _wakeup.clear()
+        if not _heap:
+            await _wakeup.wait()
+            continue
+        banned_until, chat_id, user_id = _heap[0]
+        delay = banned_until - time.time()
+        if delay > 0:
+            try:
+                await asyncio.wait_for(_wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+            continue
+        heapq.heappop(_heap)
+        current = _deadlines.get((chat_id, user_id))
+        if current is None or current[0] != banned_until:
+            continue
+        del _deadlines[(chat_id, user_id)]
+        try:
+            await _on_expire(chat_id, user_id, current[1])
+        except Exception as e:
+            logger.error("Ошибка при снятии блокировки: %s", e, extra={"chat_id": chat_id, "user_id": user_id})
+
+
+async def start(on_expire):
+    """Загружает блокировки из БД и запускает планировщик.
+       on_expire(chat_id, user_id, first_name) вызывается в момент окончания каждой временной блокировки.
+       Блокировки, истёкшие, пока бот был остановлен, удаляются без уведомлений в группах
+       (ограничение с until_date Telegram уже снял сам); администраторам отправляется одна сводка."""
+    global _wakeup, _task, _on_expire
+    _on_expire = on_expire
+    _wakeup = asyncio.Event()
+    now = int(time.time())
+    expired = 0
+    for chat_id, user_id, first_name, banned_until in await storage.get_all_bans():
+        if banned_until != 0 and banned_until <= now:
+            expired += 1
+        else:
+            _schedule(chat_id, user_id, first_name, banned_until)
+    if expired:
+        await storage.remove_expired_bans(now)
+        logger.info("Удалены блокировки, истёкшие до запуска: %s", expired)
+        text = f"Пока бот был остановлен, истекли блокировки: {expired}. Записи о них удалены."
+        for admin_id in ADMIN_IDS:
+            outbox.post(functools.partial(bot.send_message, chat_id=int(admin_id), text=text), chat_id=int(admin_id))
+    _task = asyncio.create_task(_run())
+
+
+def stop():
+    if _task is not None:
+        _task.cancel()
+
+
+async def add(chat_id: int, user_id: int, first_name: str, banned_until: int, reason: str):
+    """Сохраняет блокировку в группе (banned_until = 0 — навсегда) и планирует её окончание."""
+    await storage.add_ban(chat_id, user_id, first_name, banned_until, reason)
+    _schedule(chat_id, user_id, first_name, banned_until)
+
+
+def schedule(chat_id: int, user_id: int, first_name: str, banned_until: int):
+    """Планирует окончание блокировки, уже сохранённой в БД (storage.record_violation)."""
+    _schedule(chat_id, user_id, first_name, banned_until)
+
+
+async def remove(chat_id: int, user_id: int):
+    """Удаляет блокировку пользователя в группе и отменяет запланированное окончание."""
+    await storage.remove_ban(chat_id, user_id)
+    _deadlines.pop((chat_id, user_id), None)
+
+
+async def restore_permissions(chat_id: int, user_id: int):
+    """Возвращает пользователю права на отправку сообщений в группе."""
+    await outbox.call(functools.partial(
+        bot.restrict_chat_member,
+        chat_id=chat_id,
+        user_id=user_id,
+        permissions=types.ChatPermissions(
+            can_send_messages=True,
+            can_send_media_messages=True,
+            can_send_other_messages=True,
+            can_add_web_page_previews=True,
+            can_send_polls=True,
+            can_change_info=True,
+            can_invite_users=True,
+            can_pin_messages=True
+        ),
+        until_date=0
+    ))
+
+
+# Удаление недавних сообщений заблокированного пользователя: ID берутся из таблицы ads
+# и удаляются пачками через deleteMessages (до PURGE_BATCH_SIZE ID за запрос) в общей очереди
+# запросов к Telegram (outbox) с её ограничением частоты. Сообщения, которые уже удалены,
+# Telegram пропускает; старше 48 часов бот удалить не может.
+PURGE_BATCH_SIZE = 100
+
+
+async def purge_messages(chat_id: int, user_id: int, hours: int) -> int:
+    """Удаляет сообщения с объявлениями пользователя в группе за последние hours часов.
+       Возвращает число ID сообщений, отправленных на удаление."""
+    message_ids = await storage.get_message_ids(chat_id, user_id, int(time.time()) - hours * 3600)
+    for start in range(0, len(message_ids), PURGE_BATCH_SIZE):
+        await outbox.call(functools.partial(
+            bot.delete_messages, chat_id=chat_id, message_ids=message_ids[start:start + PURGE_BATCH_SIZE]
+        ))
+    metrics.inc("purged_messages", len(message_ids))
+    return len(message_ids)
@@ -0,0 +1,50 @@
+# Индексы по группам: chat_id -> индекс группы. Индекс группы создаётся при первом добавлении
+# в неё, поэтому память занимают только группы с данными. Используется для индекса одинаковых
+# объявлений (near_duplicates) и индекса фото (photos).
+# Набор индексов строится заново по снимку БД в фоне (при запуске и при очистке). То, что добавлено
+# после начала перестройки, записывается в её список и переносится в новый набор перед подменой,
+# иначе подмена потеряла бы объявления, добавленные между снимком и подменой.
+
+
+class ChatIndexes:
+    def __init__(self, factory):
+        self._factory = factory  # создаёт пустой индекс группы с методом add(*item)
+        self.by_chat = {}
+        self._rebuilds = []  # списки (chat_id, *item), по одному на каждую идущую перестройку
+
+    def __len__(self):
+        return len(self.by_chat)
+
+    def _add_to(self, target: dict, chat_id: int, *item):
+        chat_index = target.get(chat_id)
+        if chat_index is None:
+            chat_index = target[chat_id] = self._factory()
+        chat_index.add(*item)
+
+    def get(self, chat_id: int):
+        return self.by_chat.get(chat_id)
+
+    def add(self, chat_id: int, *item):
+        for added in self._rebuilds:
+            added.append((chat_id, *item))
+        self._add_to(self.by_chat, chat_id, *item)
+
+    def build(self, rows) -> dict:
+        """Строит новый набор индексов по строкам (chat_id, *item); текущий набор не меняется."""
+        new_indexes = {}
+        for chat_id, *item in rows:
+            self._add_to(new_indexes, chat_id, *item)
+        return new_indexes
+
+    def start_rebuild(self) -> list:
+        """Вызывается до чтения снимка БД для build; результат передаётся в finish_rebuild."""
+        added = []
+        self._rebuilds.append(added)
+        return added
+
+    def finish_rebuild(self, new_indexes: dict, added: list):
+        """Переносит в новый набор добавленное с начала перестройки и подменяет им текущий."""
+        self._rebuilds.remove(added)
+        for row in added:
+            self._add_to(new_indexes, *row)
+        self.by_chat = new_indexes
@@ -0,0 +1,44 @@
+from config import GROUP_ID, ADMIN_IDS, GROUPS as CONFIGURED_GROUPS
+
+# Группы, которые модерирует бот, и их администраторы. ADMIN_IDS управляют всеми группами,
+# администраторы из config.GROUPS — только своей. Команды администратора в личном чате относятся
+# к выбранной группе (/group); у администратора одной группы она выбрана всегда.
+GROUPS = {GROUP_ID: []}
+for _chat_id, _admins in CONFIGURED_GROUPS.items():
+    GROUPS[int(_chat_id)] = [str(admin_id) for admin_id in _admins]
+CHAT_IDS = frozenset(GROUPS)
+
+_selected = {}  # user_id -> chat_id, выбранная командой /group группа
+
+
+def admins(chat_id: int) -> list:
+    """ID администраторов группы (строки, как в ADMIN_IDS)."""
+    result = [str(admin_id) for admin_id in ADMIN_IDS]
+    result += [admin_id for admin_id in GROUPS.get(chat_id, []) if admin_id not in result]
+    return result
+
+
+def admin_chats(user_id: int) -> list:
+    """Группы, которыми управляет пользователь."""
+    return [chat_id for chat_id in GROUPS if str(user_id) in admins(chat_id)]
+
+
+def current(user_id: int):
+    """Группа, к которой относятся команды администратора, или None, если пользователь не администратор."""
+    chats = admin_chats(user_id)
+    if not chats:
+        return None
+    selected = _selected.get(user_id)
+    return selected if selected in chats else chats[0]
+
+
+def select(user_id: int, chat_id: int) -> bool:
+    if chat_id not in admin_chats(user_id):
+        return False
+    _selected[user_id] = chat_id
+    return True
+
+
+def label(chat_id: int) -> str:
+    """Указание группы для уведомлений администраторам; при одной группе — пустая строка."""
+    return f" (группа {chat_id})" if len(GROUPS) > 1 else ""
@@ -1,12 +1,15 @@
-import sqlite3
+import asyncio
+import functools
+import logging
 import time
 import re
 from aiogram import Router, types, F
 from aiogram.types import Message
 from aiogram.filters import CommandStart, Command
-from config import DB_PATH, GROUP_ID, ADMIN_IDS, bot
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from config import RESTORE_PERMISSIONS_ON_BAN_EXPIRY, PURGE_ON_BAN_HOURS, bot
+from app import storage, similarity, near_duplicates, photos, workers, outbox, bans, metrics, groups, albums, hashing, locks, load
+
+logger = logging.getLogger(__name__)
 
 router = Router()
 
@@ -40,176 +43,131 @@ def normalize_text(text: str) -> str:
     text = re.sub(r'[^\w\s]', '', text)
     return text.strip()
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    return conn
-
-
-def get_ad_record(user_id: int, photo_id: str, text: str, thread_id: int):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    topic_settings = get_topic_settings(thread_id)
-    ad_frequency_seconds = topic_settings["ad_frequency_days"] * 24 * 60 * 60
-    current_time = int(time.time())
-    time_threshold = current_time - ad_frequency_seconds
-
-    result = None
-
-    # Если есть фото, ищем по photo_id
-    if photo_id:
-        cursor.execute(
-            "SELECT id, thread_id, timestamp, text FROM ads WHERE user_id=? AND photo_id=? AND timestamp >= ?",
-            (user_id, photo_id, time_threshold)
-        )
-        result = cursor.fetchone()  # (id, thread_id, timestamp, text) или None
-
-    # Если есть текст, ищем по text (если фото не найдено или его нет)
-    if text and not result:
-        cursor.execute(
-            "SELECT id, thread_id, timestamp, text FROM ads WHERE user_id=? AND text=? AND timestamp >= ?",
-            (user_id, text, time_threshold)
-        )
-        result = cursor.fetchone()  # (id, thread_id, timestamp, text) или None
-
-    conn.close()
-    return result
-
-# Вставка новой записи в БД
-def insert_ad_record(user_id: int, thread_id: int, text: str, photo_id: str):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    current_time = int(time.time())
-    cursor.execute(
-        "INSERT INTO ads (user_id, thread_id, text, photo_id, timestamp) VALUES (?, ?, ?, ?, ?)",
-        (user_id, thread_id, text, photo_id, current_time)
-    )
-    conn.commit()
-    conn.close()
-
-# Функция обновления записи рекламы
-def update_ad_record(record_id: int, new_thread_id: int):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    current_time = int(time.time())
-    cursor.execute("UPDATE ads SET timestamp=?, thread_id=? WHERE id=?", (current_time, new_thread_id, record_id))
-    conn.commit()
-    conn.close()
-
-def get_ad_warnings(user_id: int, ad_key: str):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT warning_count FROM warnings WHERE user_id=? AND ad_key=?", (user_id, ad_key))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else 0
-
-def increase_ad_warnings(user_id: int, ad_key: str):
-    current_warnings = get_ad_warnings(user_id, ad_key)
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    if current_warnings == 0:
-        cursor.execute(
-            "INSERT INTO warnings (user_id, ad_key, warning_count, last_warning) VALUES (?, ?, ?, ?)",
-            (user_id, ad_key, 1, int(time.time()))
-        )
-    else:
-        cursor.execute(
-            "UPDATE warnings SET warning_count = warning_count + 1, last_warning=? WHERE user_id=? AND ad_key=?",
-            (int(time.time()), user_id, ad_key)
-        )
-    conn.commit()
-    conn.close()
-    return current_warnings + 1
-
-def reset_ad_warnings(user_id: int, ad_key: str):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM warnings WHERE user_id=? AND ad_key=?", (user_id, ad_key))
-    conn.commit()
-    conn.close()
-
-def get_topic_settings(thread_id: int):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT enabled, block_days, warnings_limit, ad_frequency_days FROM topics WHERE thread_id=?", (thread_id,))
-    result = cursor.fetchone()
-    conn.close()
-    if result:
-        return {
-            "enabled": bool(result[0]),
-            "block_days": result[1],
-            "warnings_limit": result[2],
-            "ad_frequency_days": result[3]
-        }
-    else:
-        return {
-            "enabled": True,
-            "block_days": 5,
-            "warnings_limit": 3,
-            "ad_frequency_days": 5  # Значение по умолчанию
-        }
-
-def ensure_topic_exists(thread_id: int):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT thread_id FROM topics WHERE thread_id=?", (thread_id,))
-    if not cursor.fetchone():
-        cursor.execute(
-            "INSERT INTO topics (thread_id, enabled, block_days, warnings_limit) VALUES (?, ?, ?, ?)",
-            (thread_id, 1, 5, 3)
-        )
-    conn.commit()
-    conn.close()
-
 # Если message.message_thread_id отсутствует, считаем, что это тема General (thread_id = 0)
 def get_thread_id(message: Message) -> int:
     return message.message_thread_id if message.message_thread_id is not None else 0
 
-# Отправка уведомления в тему General (thread_id = 0)
-async def notify_general(text: str):
-    try:
-        await bot.send_message(chat_id=GROUP_ID, message_thread_id=0, text=text, parse_mode="HTML")
-    except Exception as e:
-        print("Ошибка отправки уведомления в General:", e)
+# Отправка уведомления в тему General (thread_id = 0) группы
+def notify_general(chat_id: int, text: str):
+    outbox.post(
+        functools.partial(bot.send_message, chat_id=chat_id, message_thread_id=0, text=text, parse_mode="HTML"),
+        chat_id=chat_id
+    )
 
-async def notify_admins_about_ban(user_id: int, first_name: str, reason: str):
+def notify_admins_about_ban(chat_id: int, user_id: int, first_name: str, reason: str):
     user_link = f'<a href="tg://user?id={user_id}">{first_name}</a>'
-    for admin_id in ADMIN_IDS:
-        try:
-            await bot.send_message(
+    # Администраторам группы сообщения уходят параллельно через очередь, без ожидания отправки
+    for admin_id in groups.admins(chat_id):
+        outbox.post(
+            functools.partial(
+                bot.send_message,
                 chat_id=int(admin_id),
-                text=f"Пользователь {user_link} (ID: {user_id}) заблокирован по причине: {reason}",
+                text=f"Пользователь {user_link} (ID: {user_id}) заблокирован{groups.label(chat_id)} по причине: {reason}",
                 parse_mode="HTML"
-            )
-        except Exception as e:
-            print(f"Не удалось отправить сообщение администратору {admin_id}: {e}")
+            ),
+            chat_id=int(admin_id)
+        )
 
-async def notify_admins_suspicious_similarity(user_id: int, first_name: str, current_text: str, previous_text: str, similarity: float, current_message_link: str):
+async def _send_suspicious_alert(chat_id: int, text: str, merged: int):
+    if merged:
+        text += f"\nОбъединено похожих уведомлений об этом пользователе: {merged}"
+    return await bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML")
+
+def notify_admins_suspicious_similarity(chat_id: int, user_id: int, first_name: str, current_text: str, previous_text: str, similarity: float, current_message_link: str, previous_user_id: int = None):
     user_link = f'<a href="tg://user?id={user_id}">{first_name}</a>'
-    for admin_id in ADMIN_IDS:
-        try:
-            await bot.send_message(
-                chat_id=int(admin_id),
-                text=(
-                    f"Обнаружено подозрительное сообщение от {user_link} (ID: {user_id}).\n"
-                    f"Текущий текст: <code>{current_text}</code>\n"
-                    f"Предыдущий текст: <code>{previous_text}</code>\n"
-                    f"Схожесть: {similarity:.2%}\n"
-                    f"Ссылка на текущее сообщение: {current_message_link}"
-                ),
-                parse_mode="HTML"
-            )
-        except Exception as e:
-            print(f"Не удалось уведомить админа {admin_id}: {e}")
+    # previous_user_id указывается, если похожее объявление разместил другой пользователь
+    if previous_user_id is not None:
+        previous_label = f'Текст <a href="tg://user?id={previous_user_id}">другого пользователя</a> (ID: {previous_user_id})'
+    else:
+        previous_label = "Предыдущий текст"
+    text = (
+        f"Обнаружено подозрительное сообщение{groups.label(chat_id)} от {user_link} (ID: {user_id}).\n"
+        f"Текущий текст: <code>{current_text}</code>\n"
+        f"{previous_label}: <code>{previous_text}</code>\n"
+        f"Схожесть: {similarity:.2%}\n"
+        f"Ссылка на текущее сообщение: {current_message_link}"
+    )
+    # Повторные уведомления об одном пользователе за outbox.COALESCE_SECONDS объединяются в одно
+    for admin_id in groups.admins(chat_id):
+        outbox.post(
+            functools.partial(_send_suspicious_alert, int(admin_id), text),
+            chat_id=int(admin_id),
+            coalesce_key=("similarity", chat_id, user_id, admin_id)
+        )
 
 
-@router.message(F.chat.id == GROUP_ID)
+@router.message(F.chat.id.in_(groups.CHAT_IDS))
+@metrics.timed("message")
 async def handle_group_message(message: types.Message):
+    metrics.inc("messages")
+    # Альбом проверяется целиком при его первом сообщении, как одно объявление
+    album_messages = [message]
+    if message.media_group_id:
+        album_messages = await albums.collect(message)
+        if album_messages is None:
+            return
+        metrics.inc("albums")
+        message = next((album_message for album_message in album_messages if album_message.caption), album_messages[0])
+
+    # При перегрузке проверки упрощаются (app/load.py)
+    tier = load.begin(message.date.timestamp())
+    started, stages, decision = time.perf_counter(), {}, "error"
+    metrics.current_stages.set(stages)
+    try:
+        # Проверка читает прошлые объявления и предупреждения, а потом записывает новые,
+        # поэтому сообщения одного пользователя в группе проверяются по очереди
+        async with locks.hold((message.chat.id, message.from_user.id)):
+            decision = await check_message(message, album_messages, tier)
+    finally:
+        load.end()
+        _log_decision(message, tier, decision, stages, started)
+
+
+async def recheck_message(message: types.Message, album_messages: list, checked_at: int, exact_checked: bool):
+    """Проверки, отложенные при перегрузке; выполняются в фоне, когда нагрузка спадает."""
+    started, stages, decision = time.perf_counter(), {}, "error"
+    metrics.current_stages.set(stages)
+    try:
+        async with locks.hold((message.chat.id, message.from_user.id)):
+            decision = await check_message(message, album_messages, load.FULL, checked_at, exact_checked)
+    finally:
+        _log_decision(message, load.FULL, decision, stages, started, recheck=True)
+
+
+def _log_decision(message: types.Message, tier: int, decision: str, stages: dict, started: float,
+                  recheck: bool = False):
+    # Нарушения записываются всегда, остальные сообщения — на уровне DEBUG, с выборкой (app/logs.py)
+    level = logging.INFO if decision in ("warning", "ban", "flood", "error") else logging.DEBUG
+    if not logger.isEnabledFor(level):
+        return
+    logger.log(
+        level, "%s: %s", "Отложенная проверка" if recheck else "Сообщение проверено", decision,
+        extra={
+            "chat_id": message.chat.id,
+            "user_id": message.from_user.id,
+            "thread_id": get_thread_id(message),
+            "message_id": message.message_id,
+            "decision": decision,
+            "tier": tier,
+            "stages_ms": {name: round(seconds * 1000, 1) for name, seconds in stages.items()},
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+    )
+
+
+async def check_message(message: types.Message, album_messages: list, tier: int = load.FULL,
+                        checked_at: int = None, exact_checked: bool = False):
+    """Проверяет объявление (одно сообщение или альбом) и применяет меры при нарушении.
+       tier — режим проверки (app/load.py). checked_at — время упрощённой проверки, если это отложенная
+       проверка: объявление сравнивается только с объявлениями из более ранних сообщений. exact_checked — точные проверки
+       уже выполнены и объявление уже сохранено: выполняются только остальные проверки.
+       Возвращает решение для журнала: clean, warning, ban, flood, deferred, short или topic_disabled."""
+    chat_id = message.chat.id
     thread_id = get_thread_id(message)
-    ensure_topic_exists(thread_id)
-    topic_settings = get_topic_settings(thread_id)
+    await storage.ensure_topic_exists(chat_id, thread_id)
+    topic_settings = storage.get_topic_settings(chat_id, thread_id)
     if not topic_settings["enabled"]:
-        return
+        return "topic_disabled"
 
     user_id = message.from_user.id
     first_name = message.from_user.first_name
@@ -219,142 +177,274 @@ async def handle_group_message(message: types.Message):
     # Определяем текст и фото
     text_content = message.text or message.caption or ""  # Текст или подпись
     norm_text = normalize_text(text_content) if text_content else ""
-    photo_id = message.photo[-1].file_id if message.photo else ""  # ID последнего фото
+    # Уникальный ID фото: в отличие от file_id не меняется при повторной отправке того же файла
+    photo_messages = [album_message for album_message in album_messages if album_message.photo]
+    photo_ids = [album_message.photo[-1].file_unique_id for album_message in photo_messages]
+    photo_id = photo_ids[0] if photo_ids else ""
+    photo_hashes = [None] * len(photo_ids)
 
     # Игнорируем короткие сообщения без фото
     if not photo_id and len(text_content) < 20:
-        return
+        return "short"
 
     current_time = int(time.time())
+
+    if tier == load.FLOOD:
+        # Только лимит сообщений; остальные проверки — когда нагрузка спадёт
+        if load.flooding(chat_id, user_id):
+            metrics.inc("load.flood_deletes")
+            await _delete_messages(chat_id, message, album_messages)
+            return "flood"
+        load.defer(message, album_messages, current_time, exact_checked=False)
+        return "deferred"
+
     violation = False
     violation_reason = ""
-    matched_ad_key = norm_text if norm_text else photo_id
-
-    # Получаем все предыдущие записи пользователя за последние 5 дней
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT text, photo_id, timestamp, thread_id FROM ads WHERE user_id=? AND timestamp >= ?",
-        (user_id, current_time - ad_frequency_seconds)
-    )
-    previous_ads = cursor.fetchall()  # (text, photo_id, timestamp, thread_id)
-    conn.close()
+    matched_ad_key = hashing.text_key(norm_text) if norm_text else photo_id
+    # За время отсрочки сохранены более поздние объявления, а может быть, и само это;
+    # сравнивать нужно только с объявлениями из более ранних сообщений
+    before_message_id = None
+    if checked_at is not None:
+        before_message_id = min(album_message.message_id for album_message in album_messages)
+    # Вектор текста считается один раз: для сравнения и для сохранения вместе с объявлением
+    features = None
 
     # Проверка текста (если он есть)
     if norm_text:
-        ad_record = get_ad_record(user_id, "", norm_text, thread_id)
+        ad_record = None if exact_checked else await storage.get_ad_record(
+            chat_id, user_id, "", norm_text, thread_id, before_message_id
+        )
         if ad_record:
             violation = True
-            matched_ad_key = norm_text
+            matched_ad_key = hashing.text_key(norm_text)
             date_str = time.strftime('%d.%m.%Y в %H:%M', time.localtime(ad_record[2]))
             if ad_record[1] == thread_id:
                 violation_reason = f"Вы уже размещали это объявление в этой теме {date_str}."
             else:
                 violation_reason = f"Вы уже размещали это объявление в другой теме {date_str}."
-        else:
-            for prev_text, prev_photo_id, prev_timestamp, prev_thread_id in previous_ads:
-                if prev_text and not prev_photo_id:
-                    documents = [prev_text, norm_text]
-                    vectorizer = TfidfVectorizer()
-                    try:
-                        matrix = vectorizer.fit_transform(documents)
-                        similarity = cosine_similarity(matrix)[0][1]
-                        if similarity >= 0.75:
-                            violation = True
-                            matched_ad_key = prev_text
-                            date_str = time.strftime('%d.%m.%Y в %H:%M', time.localtime(prev_timestamp))
-                            similarity_percent = int(similarity * 100)
-                            if prev_thread_id == thread_id:
-                                violation_reason = (
-                                    f"Ваше сообщение слишком похоже (схожесть {similarity_percent}%) "
-                                    f"на объявление, которое вы разместили в этой теме {date_str}."
-                                )
-                            else:
-                                violation_reason = (
-                                    f"Ваше сообщение слишком похоже (схожесть {similarity_percent}%) "
-                                    f"на объявление, которое вы разместили в другой теме {date_str}."
-                                )
-                            break
-                        elif 0.35 <= similarity < 0.75:
-                            current_message_link = f"https://t.me/c/{str(GROUP_ID)[4:]}/{message.message_id}"
-                            await notify_admins_suspicious_similarity(
-                                user_id, first_name, text_content, prev_text, similarity, current_message_link
-                            )
-                    except ValueError as e:
-                        print(f"Ошибка при вычислении схожести: {e}")
+        elif tier == load.FULL:
+            # Все предыдущие записи пользователя за период темы
+            previous_ads = await storage.get_recent_ads(
+                chat_id, user_id, current_time - ad_frequency_seconds, before_message_id
+            )
+            # Сравниваем с текстовыми объявлениями пользователя за период одной матричной операцией
+            metrics.inc("similarity.checks")
+            try:
+                with metrics.span("similarity"):
+                    features, best_match, suspicious_matches = await workers.run(
+                        similarity.check_text, norm_text, previous_ads
+                    )
+            except asyncio.TimeoutError:
+                metrics.inc("similarity.timeouts")
+                logger.warning(
+                    "Проверка схожести не уложилась в отведённое время",
+                    extra={"chat_id": chat_id, "user_id": user_id, "thread_id": thread_id}
+                )
+                best_match, suspicious_matches = None, []
+            if best_match:
+                similarity_value, (prev_text, prev_photo_id, prev_timestamp, prev_thread_id, _) = best_match
+                violation = True
+                matched_ad_key = hashing.text_key(prev_text)
+                date_str = time.strftime('%d.%m.%Y в %H:%M', time.localtime(prev_timestamp))
+                similarity_percent = int(similarity_value * 100)
+                if prev_thread_id == thread_id:
+                    violation_reason = (
+                        f"Ваше сообщение слишком похоже (схожесть {similarity_percent}%) "
+                        f"на объявление, которое вы разместили в этой теме {date_str}."
+                    )
+                else:
+                    violation_reason = (
+                        f"Ваше сообщение слишком похоже (схожесть {similarity_percent}%) "
+                        f"на объявление, которое вы разместили в другой теме {date_str}."
+                    )
+            else:
+                current_message_link = f"https://t.me/c/{str(chat_id)[4:]}/{message.message_id}"
+                for similarity_value, (prev_text, *_) in suspicious_matches:
+                    notify_admins_suspicious_similarity(
+                        chat_id, user_id, first_name, text_content, prev_text, similarity_value, current_message_link
+                    )
+
+    # Проверка на такое же объявление от другого пользователя (несколько аккаунтов одного спамера)
+    cross_user_action = topic_settings["cross_user_action"]
+    if norm_text and not violation and cross_user_action != "off" and tier == load.FULL:
+        with metrics.span("cross_user"):
+            cross_match = near_duplicates.query(chat_id, user_id, norm_text, current_time - ad_frequency_seconds)
+        if cross_match:
+            metrics.inc("cross_user.matches")
+            similarity_value, (other_user_id, other_thread_id, other_timestamp, other_text) = cross_match
+            if cross_user_action == "warn":
+                violation = True
+                matched_ad_key = hashing.text_key(norm_text)
+                date_str = time.strftime('%d.%m.%Y в %H:%M', time.localtime(other_timestamp))
+                if other_thread_id == thread_id:
+                    violation_reason = f"Такое же объявление уже разместил другой участник в этой теме {date_str}."
+                else:
+                    violation_reason = f"Такое же объявление уже разместил другой участник в другой теме {date_str}."
+            else:
+                current_message_link = f"https://t.me/c/{str(chat_id)[4:]}/{message.message_id}"
+                notify_admins_suspicious_similarity(
+                    chat_id, user_id, first_name, text_content, other_text, similarity_value, current_message_link,
+                    previous_user_id=other_user_id
+                )
 
     # Проверка фото (если оно есть)
     if photo_id and not violation:
-        ad_record = get_ad_record(user_id, photo_id, "", thread_id)
+        ad_record = None if exact_checked else await storage.get_photo_record(
+            chat_id, user_id, photo_ids, thread_id, before_message_id
+        )
+        photo_match = None
+        if not ad_record and tier == load.FULL:
+            with metrics.span("photo"):
+                photo_hashes = await asyncio.gather(
+                    *(photos.fingerprint(photo_message.photo) for photo_message in photo_messages)
+                )
+                for photo_hash in photo_hashes:
+                    if photo_hash is not None:
+                        photo_match = photos.find(chat_id, user_id, photo_hash, current_time - ad_frequency_seconds)
+                        if photo_match:
+                            break
         if ad_record:
             violation = True
-            matched_ad_key = photo_id
+            matched_ad_key = ad_record[4]
             date_str = time.strftime('%d.%m.%Y в %H:%M', time.localtime(ad_record[2]))
             if ad_record[1] == thread_id:
                 violation_reason = f"Вы уже размещали это фото в этой теме {date_str}."
             else:
                 violation_reason = f"Вы уже размещали это фото в другой теме {date_str}."
+        elif photo_match:
+            # Визуально то же фото (пересжатое или слегка обрезанное)
+            _, (_, prev_thread_id, prev_timestamp, prev_photo_id) = photo_match
+            violation = True
+            matched_ad_key = prev_photo_id
+            date_str = time.strftime('%d.%m.%Y в %H:%M', time.localtime(prev_timestamp))
+            if prev_thread_id == thread_id:
+                violation_reason = f"Вы уже размещали это фото в этой теме {date_str}."
+            else:
+                violation_reason = f"Вы уже размещали это фото в другой теме {date_str}."
         elif norm_text and ad_record and ad_record[3]:
-            documents = [ad_record[3], norm_text]
-            vectorizer = TfidfVectorizer()
-            try:
-                matrix = vectorizer.fit_transform(documents)
-                similarity = cosine_similarity(matrix)[0][1]
-                if similarity >= 0.75:
-                    violation = True
-                    matched_ad_key = ad_record[3]
-                    date_str = time.strftime('%d.%m.%Y в %H:%M', time.localtime(ad_record[2]))
-                    similarity_percent = int(similarity * 100)
-                    if ad_record[1] == thread_id:
-                        violation_reason = (
-                            f"Ваше фото с похожим текстом (схожесть {similarity_percent}%) "
-                            f"уже было размещено в этой теме {date_str}."
-                        )
-                    else:
-                        violation_reason = (
-                            f"Ваше фото с похожим текстом (схожесть {similarity_percent}%) "
-                            f"уже было размещено в другой теме {date_str}."
-                        )
-            except ValueError as e:
-                print(f"Ошибка при вычислении схожести: {e}")
+            similarity_value = (await workers.run(similarity.score_texts, norm_text, [ad_record[3]]))[0]
+            if similarity_value >= similarity.SIMILARITY_THRESHOLD:
+                violation = True
+                matched_ad_key = hashing.text_key(ad_record[3])
+                date_str = time.strftime('%d.%m.%Y в %H:%M', time.localtime(ad_record[2]))
+                similarity_percent = int(similarity_value * 100)
+                if ad_record[1] == thread_id:
+                    violation_reason = (
+                        f"Ваше фото с похожим текстом (схожесть {similarity_percent}%) "
+                        f"уже было размещено в этой теме {date_str}."
+                    )
+                else:
+                    violation_reason = (
+                        f"Ваше фото с похожим текстом (схожесть {similarity_percent}%) "
+                        f"уже было размещено в другой теме {date_str}."
+                    )
 
     # Обработка нарушения
+    decision = "clean"
     if violation:
-        warning_count = increase_ad_warnings(user_id, matched_ad_key)
-        if warning_count >= topic_settings["warnings_limit"]:
-            block_seconds = topic_settings["block_days"] * 24 * 3600 if topic_settings["block_days"] > 0 else 0
-            banned_until = current_time + block_seconds if block_seconds > 0 else 0
-            try:
-                await bot.restrict_chat_member(
-                    chat_id=GROUP_ID,
+        metrics.inc("violations")
+        warnings_limit = topic_settings["warnings_limit"]
+        block_seconds = topic_settings["block_days"] * 24 * 3600 if topic_settings["block_days"] > 0 else 0
+        banned_until = current_time + block_seconds if block_seconds > 0 else 0
+        # Предупреждение, блокировка и сброс счётчика — одна транзакция;
+        # запросы к Telegram отправляются после неё и одновременно. Ответы в группу ставятся
+        # в очередь без ожидания: при исчерпанном лимите группы (20 в минуту) они ждали бы
+        # отправки под блокировкой пользователя; ожидаются только удаление и ограничение прав
+        warning_count = await storage.record_violation(
+            chat_id, user_id, first_name, matched_ad_key, warnings_limit, banned_until, "Повторные нарушения"
+        )
+        if warning_count >= warnings_limit:
+            decision = "ban"
+            metrics.inc("bans")
+            bans.schedule(chat_id, user_id, first_name, banned_until)
+            block_duration = 'навсегда' if topic_settings['block_days'] == 0 else f'на {topic_settings["block_days"]} дней'
+            block_message = (
+                f"🚫 {user_link}, {violation_reason}\n"
+                f"Вы были заблокированы {block_duration} за повторные нарушения.\n"
+                f"Ознакомьтесь с правилами: <a href=\"https://t.me/greenHillsRulesBot?start=start\">Правила</a>."
+            )
+            outbox.post(
+                functools.partial(message.answer, block_message, disable_web_page_preview=True, parse_mode="HTML"),
+                chat_id=chat_id, priority=outbox.MODERATION
+            )
+            side_effects = [
+                outbox.call(functools.partial(
+                    bot.restrict_chat_member,
+                    chat_id=chat_id,
                     user_id=user_id,
                     permissions=types.ChatPermissions(can_send_messages=False),
                     until_date=banned_until
-                )
-                block_duration = 'навсегда' if topic_settings['block_days'] == 0 else f'на {topic_settings["block_days"]} дней'
-                block_message = (
-                    f"🚫 {user_link}, {violation_reason}\n"
-                    f"Вы были заблокированы {block_duration} за повторные нарушения.\n"
-                    f"Ознакомьтесь с правилами: <a href=\"https://t.me/greenHillsRulesBot?start=start\">Правила</a>."
-                )
-                await message.answer(block_message, disable_web_page_preview=True, parse_mode="HTML")
-                await notify_admins_about_ban(user_id, first_name, "Повторные нарушения")
-                add_ban(user_id, first_name, banned_until, "Повторные нарушения")
-            except Exception as e:
-                print(f"Ошибка при блокировке: {e}")
-            reset_ad_warnings(user_id, matched_ad_key)
+                )),
+            ]
+            if PURGE_ON_BAN_HOURS:
+                # Остальные объявления спамера в других темах удаляются вместе с текущим сообщением
+                side_effects.append(bans.purge_messages(chat_id, user_id, PURGE_ON_BAN_HOURS))
+            notify_admins_about_ban(chat_id, user_id, first_name, "Повторные нарушения")
         else:
+            decision = "warning"
             warning_message = (
                 f"⚠️ {user_link}, ваше сообщение удалено: {violation_reason}\n"
-                f"Предупреждение № {warning_count}/{topic_settings['warnings_limit']}.\n"
+                f"Предупреждение № {warning_count}/{warnings_limit}.\n"
                 f"Ознакомьтесь с <a href=\"https://t.me/greenHillsRulesBot?start=start\">правилами</a>."
             )
-            await message.reply(warning_message, disable_web_page_preview=True, parse_mode="HTML")
-        await message.delete()
+            # Ответ и удаление идут независимо: ответ отправится, даже если сообщение уже удалено
+            outbox.post(
+                functools.partial(message.reply, warning_message, disable_web_page_preview=True, parse_mode="HTML",
+                                  allow_sending_without_reply=True),
+                chat_id=chat_id, priority=outbox.MODERATION
+            )
+            side_effects = []
+        side_effects.append(_delete_messages(chat_id, message, album_messages))
+        for result in await asyncio.gather(*side_effects, return_exceptions=True):
+            if isinstance(result, Exception):
+                logger.error(
+                    "Ошибка при обработке нарушения: %s", result,
+                    extra={"chat_id": chat_id, "user_id": user_id, "thread_id": thread_id, "decision": decision}
+                )
+        return decision
+
+    # Одна запись на каждое фото альбома, текст и его вектор — только в первой
+    message_ids = [photo_message.message_id for photo_message in photo_messages] or [message.message_id]
+    if exact_checked:
+        # Объявление уже сохранено при упрощённой проверке без вектора текста и хэшей фото:
+        # посчитанные сейчас дописываются в БД (по ним строятся индексы при запуске и очистке) и в индекс фото
+        if features is not None or any(photo_hash is not None for photo_hash in photo_hashes):
+            await storage.set_ad_fingerprints(chat_id, user_id, [
+                (message_id, features if i == 0 else None, photos.to_db(photo_hash) if photo_hash is not None else None)
+                for i, (photo_hash, message_id) in enumerate(zip(photo_hashes or [None], message_ids))
+            ])
+        for album_photo_id, photo_hash in zip(photo_ids, photo_hashes):
+            photos.add(chat_id, user_id, thread_id, album_photo_id, photo_hash, checked_at)
+    else:
+        # Объявление, проверенное с отсрочкой, сохраняется со временем упрощённой проверки,
+        # чтобы порядок объявлений не зависел от того, когда спала нагрузка
+        ad_time = checked_at or current_time
+        for i, (album_photo_id, photo_hash, message_id) in enumerate(
+            zip(photo_ids or [""], photo_hashes or [None], message_ids)
+        ):
+            await storage.insert_ad_record(
+                chat_id, user_id, thread_id, norm_text if i == 0 else "", album_photo_id, features if i == 0 else None,
+                photos.to_db(photo_hash) if photo_hash is not None else None, ad_time, message_id
+            )
+            photos.add(chat_id, user_id, thread_id, album_photo_id, photo_hash, ad_time)
+        near_duplicates.add(chat_id, user_id, thread_id, norm_text, ad_time)
+        if tier == load.EXACT:
+            load.defer(message, album_messages, current_time, exact_checked=True)
+    return decision
+
+
+async def _delete_messages(chat_id: int, message: types.Message, album_messages: list):
+    if len(album_messages) > 1:
+        # Все сообщения альбома удаляются одним запросом
+        await outbox.call(functools.partial(
+            bot.delete_messages,
+            chat_id=chat_id,
+            message_ids=[album_message.message_id for album_message in album_messages]
+        ))
     else:
-        insert_ad_record(user_id, thread_id, norm_text, photo_id)
+        await outbox.call(message.delete)
 
-@router.message(F.chat.id == GROUP_ID)
+@router.message(F.chat.id.in_(groups.CHAT_IDS))
 async def handle_suspicious(message: types.Message):
     pass
 
@@ -362,34 +452,43 @@ async def handle_suspicious(message: types.Message):
 async def admin_ban(message: types.Message):
     if message.chat.type != "private":
         return
-    if str(message.from_user.id) not in ADMIN_IDS:
+    chat_id = groups.current(message.from_user.id)
+    if chat_id is None:
         return
     parts = message.text.split()
-    if len(parts) != 3:
-        await message.reply("Используйте формат: /ban+[ID пользователя]+[количество дней]\nПример: /ban 123456789 5")
+    if len(parts) not in (3, 4):
+        await message.reply(
+            "Используйте формат: /ban+[ID пользователя]+[количество дней]+[удалить сообщения за часов, необязательно]\n"
+            "Пример: /ban 123456789 5 или /ban 123456789 5 24"
+        )
         return
     try:
         target_user = int(parts[1])
         days = int(parts[2])
+        purge_hours = int(parts[3]) if len(parts) == 4 else 0
         block_seconds = days * 24 * 3600 if days > 0 else 0
         banned_until = int(time.time()) + block_seconds if days > 0 else 0
         try:
-            chat_member = await bot.get_chat_member(GROUP_ID, target_user)
+            chat_member = await bot.get_chat_member(chat_id, target_user)
             first_name = chat_member.user.first_name
         except Exception:
             first_name = "Неизвестно"
-        await bot.restrict_chat_member(
-            chat_id=GROUP_ID,
+        await outbox.call(functools.partial(
+            bot.restrict_chat_member,
+            chat_id=chat_id,
             user_id=target_user,
             permissions=types.ChatPermissions(can_send_messages=False),
             until_date=banned_until
-        )
+        ))
         user_link = f'<a href="tg://user?id={target_user}">{first_name}</a>'
         await message.reply(f"Пользователь {user_link} (ID: {target_user}) заблокирован {'навсегда' if days == 0 else f'на {days} дней'}.", parse_mode="HTML")
-        add_ban(target_user, first_name, banned_until, "Ручная блокировка администратором")
-        await notify_admins_about_ban(target_user, first_name, "Ручная блокировка администратором")
+        await bans.add(chat_id, target_user, first_name, banned_until, "Ручная блокировка администратором")
+        if purge_hours > 0:
+            purged = await bans.purge_messages(chat_id, target_user, purge_hours)
+            await message.reply(f"Удалено сообщений с объявлениями за {purge_hours} ч: {purged}.")
+        notify_admins_about_ban(chat_id, target_user, first_name, "Ручная блокировка администратором")
         # Отправляем уведомление в General о блокировке
-        await notify_general(f"Пользователь {user_link} (ID: {target_user}) был заблокирован администратором.")
+        notify_general(chat_id, f"Пользователь {user_link} (ID: {target_user}) был заблокирован администратором.")
     except Exception as e:
         await message.reply(f"Ошибка: {e}")
 
@@ -397,7 +496,8 @@ async def admin_ban(message: types.Message):
 async def admin_unban(message: types.Message):
     if message.chat.type != "private":
         return
-    if str(message.from_user.id) not in ADMIN_IDS:
+    chat_id = groups.current(message.from_user.id)
+    if chat_id is None:
         return
     parts = message.text.split()
     if len(parts) != 2:
@@ -406,81 +506,53 @@ async def admin_unban(message: types.Message):
     try:
         target_user = int(parts[1])
         try:
-            chat_member = await bot.get_chat_member(GROUP_ID, target_user)
+            chat_member = await bot.get_chat_member(chat_id, target_user)
             first_name = chat_member.user.first_name
         except Exception:
             first_name = "Неизвестно"
-        await bot.restrict_chat_member(
-            chat_id=GROUP_ID,
-            user_id=target_user,
-            permissions=types.ChatPermissions(
-                can_send_messages=True,
-                can_send_media_messages=True,
-                can_send_other_messages=True,
-                can_add_web_page_previews=True,
-                can_send_polls=True,
-                can_change_info=True,
-                can_invite_users=True,
-                can_pin_messages=True
-            ),
-            until_date=0
-        )
-        remove_ban(target_user)
+        await bans.restore_permissions(chat_id, target_user)
+        await bans.remove(chat_id, target_user)
         user_link = f'<a href="tg://user?id={target_user}">{first_name}</a>'
         await message.reply(f"Пользователь {user_link} (ID: {target_user}) успешно разблокирован.", parse_mode="HTML")
         # Отправляем уведомление в General о разблокировке
-        await notify_general(f"Пользователь {user_link} (ID: {target_user}) был разблокирован администратором.")
+        notify_general(chat_id, f"Пользователь {user_link} (ID: {target_user}) был разблокирован администратором.")
     except Exception as e:
         await message.reply(f"Ошибка: {e}")
 
-def add_ban(user_id: int, first_name: str, banned_until: int, reason: str):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO bans (user_id, first_name, banned_until, reason) VALUES (?, ?, ?, ?)",
-        (user_id, first_name, banned_until, reason)
-    )
-    conn.commit()
-    conn.close()
-
-def remove_ban(user_id: int):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM bans WHERE user_id=?", (user_id,))
-    conn.commit()
-    conn.close()
-
-def get_banned_users():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    current_time = int(time.time())
-    cursor.execute(
-        "SELECT user_id, first_name, banned_until, reason FROM bans WHERE banned_until > ? OR banned_until = 0",
-        (current_time,)
-    )
-    result = cursor.fetchall()
-    conn.close()
-    return result
+async def lift_expired_ban(chat_id: int, user_id: int, first_name: str):
+    """Вызывается планировщиком блокировок (app/bans.py) в момент окончания временной блокировки."""
+    if RESTORE_PERMISSIONS_ON_BAN_EXPIRY:
+        await bans.restore_permissions(chat_id, user_id)
+    await storage.remove_ban(chat_id, user_id)
+    user_link = f'<a href="tg://user?id={user_id}">{first_name}</a>'
+    notify_general(chat_id, f"Срок блокировки пользователя {user_link} (ID: {user_id}) истёк.")
 
 @router.message(Command("admin"))
 async def admin_panel(message: types.Message):
-    if str(message.from_user.id) not in ADMIN_IDS:
+    chat_id = groups.current(message.from_user.id)
+    if chat_id is None:
         await message.reply("У вас нет доступа к этой команде.")
         return
 
-    banned_users = get_banned_users()
+    banned_users = await storage.get_banned_users(chat_id)
     admin_text = (
         "Добро пожаловать в панель администратора!\n\n"
         "<b>Доступные команды:</b>\n"
-        "<b>Команда:</b> <code>/ban+[ID пользователя]+[количество дней]</code>\n"
-        "— Заблокировать пользователя на указанное количество дней. Если указать 0 дней, блокировка будет на неопределенное время (до момента разблокировки).\n"
-        "<b>Пример:</b> <code>/ban 123456789 5</code>\n\n"
+        "<b>Команда:</b> <code>/ban+[ID пользователя]+[количество дней]+[часов]</code>\n"
+        "— Заблокировать пользователя на указанное количество дней. Если указать 0 дней, блокировка будет на неопределенное время (до момента разблокировки). "
+        "Если указать часы, будут удалены его объявления за это время (не более 48 часов).\n"
+        "<b>Пример:</b> <code>/ban 123456789 5</code> или <code>/ban 123456789 5 24</code>\n\n"
         "<b>Команда:</b> <code>/unban+[ID пользователя]</code>\n"
         "— Разблокировать пользователя.\n"
         "<b>Пример:</b> <code>/unban 123456789</code>\n\n"
         "При блокировке пользователя ботом (автоматически или вручную) пользователь продолжает оставаться в группе и имеет возможность просматривать сообщения, но лишается права их отправлять.\n\n"
         "<b>Команда:</b> <code>/topics</code>\n"
         "— Открыть настройки тем.\n"
+        "\n<b>Команда:</b> <code>/group</code>\n"
+        "— Список групп и выбор группы, к которой относятся команды (<code>/group+[ID группы]</code>).\n"
+        "\n<b>Команда:</b> <code>/perf</code>\n"
+        "— Режим проверки при нагрузке, время обработки сообщений по этапам и счётчики "
+        "(<code>/perf reset</code> — сбросить).\n"
     )
 
     if banned_users:
@@ -499,15 +571,12 @@ async def list_topics(message: types.Message):
     # Команда должна вызываться в личном чате
     if message.chat.type != "private":
         return
-    if str(message.from_user.id) not in [str(admin) for admin in ADMIN_IDS]:
+    chat_id = groups.current(message.from_user.id)
+    if chat_id is None:
         return
 
     # Получаем список тем из базы данных
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT thread_id, enabled, block_days, warnings_limit, ad_frequency_days FROM topics")
-    topics = cursor.fetchall()
-    conn.close()
+    topics = await storage.get_topics(chat_id)
 
     if not topics:
         await message.reply("Темы не найдены.")
@@ -515,7 +584,7 @@ async def list_topics(message: types.Message):
 
     # Формируем описание доступных команд
     commands_info = (
-        "📋 <b>Панель управления темами</b>\n\n"
+        f"📋 <b>Панель управления темами</b>{groups.label(chat_id)}\n\n"
         "<b>Доступные команды:</b>\n"
         "• <code>/switch+[ID темы]</code> — переключает состояние темы (включено/выключено).\n"
         "Пример: <code>/switch 5</code>\n"
@@ -528,14 +597,17 @@ async def list_topics(message: types.Message):
         "1 предупреждение — блокировка происходит немедленно (при первом предупреждении).\n"
         "Пример: <code>/cwarn 5 3</code>\n"
         "• <code>/sdays+[ID темы]+[кол-во дней от 1 до 10]</code> — указывает минимальный допустимый интервал между рекламными объявлениями одного типа от одного пользователя.\n"
-        "Пример: <code>/sdays 0 5</code>\n\n"
+        "Пример: <code>/sdays 0 5</code>\n"
+        "• <code>/cross+[ID темы]+[notify|warn|off]</code> — действие, если разные пользователи размещают одинаковое объявление: "
+        "уведомить администраторов, выдать предупреждение или не проверять.\n"
+        "Пример: <code>/cross 5 warn</code>\n\n"
         "<b>Сводка по темам:</b>\n\n"
     )
 
     # Формируем сводку по каждой теме
     topics_summary = ""
     for t in topics:
-        topic_id, enabled, block_days, warnings_limit, ad_frequency_days = t
+        topic_id, enabled, block_days, warnings_limit, ad_frequency_days, cross_user_action = t
         state = "🟢 Включена" if enabled else "🔴 Выключена"
         ad_interval = f"{ad_frequency_days} дней"
         block_time = "навсегда" if block_days == 0 else f"{block_days} дней"
@@ -545,37 +617,18 @@ async def list_topics(message: types.Message):
             f"<b>Состояние:</b> {state}\n"
             f"<b>Интервал между рекламными объявлениями:</b> {ad_interval}\n"
             f"<b>Время блокировки:</b> {block_time}\n"
-            f"<b>Предупреждений до блокировки:</b> {warn_text}\n\n"
+            f"<b>Предупреждений до блокировки:</b> {warn_text}\n"
+            f"<b>Одинаковые объявления разных пользователей:</b> {CROSS_USER_ACTION_TEXTS.get(cross_user_action, cross_user_action)}\n\n"
         )
 
     full_text = commands_info + topics_summary
     await message.reply(full_text, parse_mode="HTML")
 
-def get_topic_status(topic_id: int):
-    """Возвращает статус темы: 1 — включена, 0 — выключена, None — тема не найдена."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT enabled FROM topics WHERE thread_id=?", (topic_id,))
-    result = cursor.fetchone()
-    conn.close()
-    return result[0] if result else None
-
-def toggle_topic_status(topic_id: int):
-    """Переключает статус темы: если включена – выключает, если выключена – включает.
-       Возвращает новый статус или None, если тема не найдена."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT enabled FROM topics WHERE thread_id=?", (topic_id,))
-    result = cursor.fetchone()
-    if not result:
-        conn.close()
-        return None
-    current_status = result[0]
-    new_status = 0 if current_status else 1
-    cursor.execute("UPDATE topics SET enabled=? WHERE thread_id=?", (new_status, topic_id))
-    conn.commit()
-    conn.close()
-    return new_status
+CROSS_USER_ACTION_TEXTS = {
+    "notify": "уведомление администраторам",
+    "warn": "предупреждение",
+    "off": "не проверяются"
+}
 
 @router.message(Command("switch"))
 async def switch_topic_handler(message: types.Message):
@@ -584,7 +637,8 @@ async def switch_topic_handler(message: types.Message):
         return
 
     # Проверка: только админы могут использовать эту команду.
-    if str(message.from_user.id) not in ADMIN_IDS:
+    chat_id = groups.current(message.from_user.id)
+    if chat_id is None:
         return
 
     # Извлекаем аргументы из сообщения (ожидается формат: /switch [номер темы])
@@ -594,12 +648,12 @@ async def switch_topic_handler(message: types.Message):
         return
 
     topic_id = int(parts[1].strip())
-    current_status = get_topic_status(topic_id)
+    current_status = await storage.get_topic_status(chat_id, topic_id)
     if current_status is None:
         await message.reply("Тема не найдена.")
         return
 
-    new_status = toggle_topic_status(topic_id)
+    new_status = await storage.toggle_topic_status(chat_id, topic_id)
     status_text = "включена 🟢" if new_status == 1 else "выключена 🔴"
     await message.reply(f"Тема {topic_id} теперь {status_text}.")
     await list_topics(message)
@@ -611,7 +665,8 @@ async def send_test_message_handler(message: types.Message):
         return
 
     # Проверка на права администратора
-    if str(message.from_user.id) not in ADMIN_IDS:
+    chat_id = groups.current(message.from_user.id)
+    if chat_id is None:
         return
 
     # Извлекаем аргументы (ожидается формат: /message [номер темы])
@@ -620,7 +675,7 @@ async def send_test_message_handler(message: types.Message):
         await message.reply("Использование: /message+[номер темы]. Пример: /message 5")
         return
     topic_id = int(parts[1].strip())
-    current_status = get_topic_status(topic_id)
+    current_status = await storage.get_topic_status(chat_id, topic_id)
     if current_status is None:
         await message.reply("Тема не найдена.")
         return
@@ -631,45 +686,15 @@ async def send_test_message_handler(message: types.Message):
 
     try:
         # Отправляем тестовое сообщение в указанную тему группы
-        await bot.send_message(chat_id=GROUP_ID, message_thread_id=thread_id, text=test_text)
+        await bot.send_message(chat_id=chat_id, message_thread_id=thread_id, text=test_text)
         await message.reply(f"Тестовое сообщение успешно отправлено в тему с идентификатором (ID) {thread_id}.")
         await list_topics(message)
     except Exception as e:
         await message.reply(f"Ошибка при отправке тестового сообщения: {e}")
 
-def update_topic_block_days(topic_id: int, days: int) -> bool:
-    """Обновляет время блокировки (block_days) в таблице topics для заданной темы.
-       Возвращает True при успехе, False если тема не найдена."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT block_days FROM topics WHERE thread_id=?", (topic_id,))
-    result = cursor.fetchone()
-    if not result:
-        conn.close()
-        return False
-    cursor.execute("UPDATE topics SET block_days=? WHERE thread_id=?", (days, topic_id))
-    conn.commit()
-    conn.close()
-    return True
-
-def update_topic_warnings_limit(topic_id: int, warnings_limit: int) -> bool:
-    """Обновляет количество предупреждений до блокировки (warnings_limit) в таблице topics для заданной темы.
-       Возвращает True при успехе, False если тема не найдена."""
-    conn = sqlite3.connect(DB_PATH)
-    cursor = conn.cursor()
-    cursor.execute("SELECT warnings_limit FROM topics WHERE thread_id=?", (topic_id,))
-    result = cursor.fetchone()
-    if not result:
-        conn.close()
-        return False
-    cursor.execute("UPDATE topics SET warnings_limit=? WHERE thread_id=?", (warnings_limit, topic_id))
-    conn.commit()
-    conn.close()
-    return True
-
-
-def create_summary_text(topic_id: int) -> str:
-    settings = get_topic_settings(topic_id)
+async def create_summary_text(chat_id: int, topic_id: int) -> str:
+    await storage.load_topics(chat_id)
+    settings = storage.get_topic_settings(chat_id, topic_id)
     if not settings:
         return "Не удалось получить настройки темы."
     block_days = settings["block_days"]
@@ -696,7 +721,8 @@ async def set_block_time_handler(message: types.Message):
     # Команда должна вызываться в личном чате.
     if message.chat.type != "private":
         return
-    if str(message.from_user.id) not in ADMIN_IDS:
+    chat_id = groups.current(message.from_user.id)
+    if chat_id is None:
         return
 
     parts = message.text.split()
@@ -715,7 +741,7 @@ async def set_block_time_handler(message: types.Message):
         await message.reply("Количество дней должно быть в диапазоне от 0 до 365.")
         return
 
-    success = update_topic_block_days(topic_id, days)
+    success = await storage.update_topic_block_days(chat_id, topic_id, days)
     if not success:
         await message.reply("Тема не найдена.")
         return
@@ -724,15 +750,16 @@ async def set_block_time_handler(message: types.Message):
     await message.reply(f"В теме {topic_id} время блокировки установлено {time_text}.")
     await list_topics(message)
 
-    summary = create_summary_text(topic_id)
-    try:
-        await bot.send_message(
-            chat_id=GROUP_ID,
+    summary = await create_summary_text(chat_id, topic_id)
+    outbox.post(
+        functools.partial(
+            bot.send_message,
+            chat_id=chat_id,
             message_thread_id=topic_id,
             text=f"Настройки темы изменены.\n{summary}"
-        )
-    except Exception as e:
-        print(f"Ошибка отправки уведомления в тему {topic_id}: {e}")
+        ),
+        chat_id=chat_id
+    )
 
 
 @router.message(Command("cwarn"))
@@ -740,7 +767,8 @@ async def set_warnings_limit_handler(message: types.Message):
     # Команда должна вызываться в личном чате.
     if message.chat.type != "private":
         return
-    if str(message.from_user.id) not in ADMIN_IDS:
+    chat_id = groups.current(message.from_user.id)
+    if chat_id is None:
         return
 
     parts = message.text.split()
@@ -759,7 +787,7 @@ async def set_warnings_limit_handler(message: types.Message):
         await message.reply("Количество предупреждений должно быть от 1 до 10.")
         return
 
-    success = update_topic_warnings_limit(topic_id, warnings_limit)
+    success = await storage.update_topic_warnings_limit(chat_id, topic_id, warnings_limit)
     if not success:
         await message.reply("Тема не найдена.")
         return
@@ -767,22 +795,24 @@ async def set_warnings_limit_handler(message: types.Message):
     await message.reply(f"В теме {topic_id} количество предупреждений до блокировки установлено на {warnings_limit}.")
     await list_topics(message)
 
-    summary = create_summary_text(topic_id)
-    try:
-        await bot.send_message(
-            chat_id=GROUP_ID,
+    summary = await create_summary_text(chat_id, topic_id)
+    outbox.post(
+        functools.partial(
+            bot.send_message,
+            chat_id=chat_id,
             message_thread_id=topic_id,
             text=f"Настройки темы изменены.\n{summary}"
-        )
-    except Exception as e:
-        print(f"Ошибка отправки уведомления в тему {topic_id}: {e}")
+        ),
+        chat_id=chat_id
+    )
 
 @router.message(Command("sdays"))
 async def set_ad_frequency(message: types.Message):
     # Команда должна вызываться в личном чате.
     if message.chat.type != "private":
         return
-    if str(message.from_user.id) not in ADMIN_IDS:
+    chat_id = groups.current(message.from_user.id)
+    if chat_id is None:
         return
 
     # Разбираем аргументы команды
@@ -805,26 +835,91 @@ async def set_ad_frequency(message: types.Message):
         days = int(parts[2])
 
     # Обновляем базу данных
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "UPDATE topics SET ad_frequency_days=? WHERE thread_id=?",
-        (days, thread_id)
-    )
-    conn.commit()
-    conn.close()
-    if cursor.rowcount == 0:
+    success = await storage.update_topic_ad_frequency(chat_id, int(thread_id), days)
+    if not success:
         await message.reply(f"Тема с ID {thread_id} не найдена.")
     else:
         await message.reply(f"Периодичность рекламы для темы {thread_id} установлена на {days} дней.")
         await list_topics(message)
 
-        summary = create_summary_text(int(thread_id))
-        try:
-            await bot.send_message(
-                chat_id=GROUP_ID,
+        summary = await create_summary_text(chat_id, int(thread_id))
+        outbox.post(
+            functools.partial(
+                bot.send_message,
+                chat_id=chat_id,
                 message_thread_id=thread_id,
                 text=f"Настройки темы изменены.\n{summary}"
-            )
-        except Exception as e:
-            print(f"Ошибка отправки уведомления в тему {thread_id}: {e}")
+            ),
+            chat_id=chat_id
+        )
+
+@router.message(Command("cross"))
+async def set_cross_user_action(message: types.Message):
+    # Команда должна вызываться в личном чате.
+    if message.chat.type != "private":
+        return
+    chat_id = groups.current(message.from_user.id)
+    if chat_id is None:
+        return
+
+    parts = message.text.split()
+    if len(parts) != 3:
+        await message.reply("Используйте: /cross+[ID темы]+[notify|warn|off]. Пример: /cross 5 warn")
+        return
+
+    topic_id_str, action = parts[1], parts[2].lower()
+    if not topic_id_str.isdigit():
+        await message.reply("ID темы должно быть числом.")
+        return
+    if action not in storage.CROSS_USER_ACTIONS:
+        await message.reply("Действие должно быть одним из: notify, warn, off.")
+        return
+
+    topic_id = int(topic_id_str)
+    success = await storage.update_topic_cross_user_action(chat_id, topic_id, action)
+    if not success:
+        await message.reply("Тема не найдена.")
+        return
+
+    await message.reply(f"В теме {topic_id} для одинаковых объявлений разных пользователей установлено: {CROSS_USER_ACTION_TEXTS[action]}.")
+    await list_topics(message)
+
+@router.message(Command("perf"))
+async def perf_handler(message: types.Message):
+    # Команда должна вызываться в личном чате.
+    if message.chat.type != "private":
+        return
+    if not groups.admin_chats(message.from_user.id):
+        return
+
+    parts = message.text.split()
+    if len(parts) == 2 and parts[1] == "reset":
+        metrics.reset()
+        await message.reply("Метрики сброшены.")
+        return
+    await message.reply(load.status() + "\n\n" + metrics.summary())
+
+@router.message(Command("group"))
+async def select_group_handler(message: types.Message):
+    # Команда должна вызываться в личном чате.
+    if message.chat.type != "private":
+        return
+    user_id = message.from_user.id
+    chats = groups.admin_chats(user_id)
+    if not chats:
+        return
+
+    parts = message.text.split()
+    if len(parts) == 2:
+        if not parts[1].lstrip("-").isdigit() or not groups.select(user_id, int(parts[1])):
+            await message.reply("Группа не найдена или у вас нет доступа к ней.")
+            return
+        await message.reply(f"Команды теперь относятся к группе {parts[1]}.")
+        return
+
+    current = groups.current(user_id)
+    lines = [f"{'▶️' if chat_id == current else '•'} <code>{chat_id}</code>" for chat_id in chats]
+    await message.reply(
+        "Ваши группы:\n" + "\n".join(lines) + "\n\nВыбрать группу: <code>/group+[ID группы]</code>",
+        parse_mode="HTML"
+    )
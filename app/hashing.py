@@ -0,0 +1,41 @@
+import hashlib
+
+# Компактный ключ содержимого объявления: 64-битный хэш нормализованного текста.
+# Хранится в ads.text_hash (поиск точных повторов идёт по нему, а не по тексту целиком)
+# и в виде строки используется как ad_key предупреждений.
+
+
+def text_hash(text: str) -> int:
+    """64-битный хэш нормализованного текста в виде знакового числа для колонки INTEGER."""
+    value = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "big")
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def text_key(text: str) -> str:
+    """ad_key предупреждений для текстового объявления."""
+    return format(text_hash(text) & ((1 << 64) - 1), "016x")
+
+
+class BloomFilter:
+    """Фильтр Блума по 64-битным хэшам: «точно нет» или «возможно есть».
+       NUM_BITS и NUM_HASHES подобраны под десятки объявлений одного пользователя
+       (около 0,1% ложных срабатываний при 50 объявлениях)."""
+
+    NUM_BITS = 1024
+    NUM_HASHES = 4
+
+    def __init__(self):
+        self.bits = 0
+
+    def _positions(self, value: int):
+        value &= (1 << 64) - 1
+        first, second = value & 0xFFFFFFFF, value >> 32
+        for i in range(self.NUM_HASHES):
+            yield (first + i * second) % self.NUM_BITS
+
+    def add(self, value: int):
+        for position in self._positions(value):
+            self.bits |= 1 << position
+
+    def __contains__(self, value: int) -> bool:
+        return all(self.bits >> position & 1 for position in self._positions(value))
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+import time
+from config import SQLITE_CHECKPOINT_SECONDS
+from app import storage, photos, near_duplicates
+
+logger = logging.getLogger(__name__)
+
+# Периодическая очистка БД: объявления старше самого длинного периода проверки среди тем,
+# давно не обновлявшиеся предупреждения и истёкшие блокировки. После удаления файл БД
+# сжимается (incremental vacuum) и обновляется статистика индексов (ANALYZE).
+INTERVAL_SECONDS = 6 * 60 * 60
+FIRST_RUN_DELAY_SECONDS = 60
+WARNINGS_TTL_DAYS = 30  # предупреждение сбрасывается, если за это время не было новых нарушений
+
+
+async def run_once() -> dict:
+    """Выполняет одну очистку и возвращает отчёт: удалённые строки по таблицам и освобождённые байты."""
+    now = int(time.time())
+    ads_before = now - await storage.max_ad_frequency_days() * 24 * 60 * 60
+    warnings_before = now - WARNINGS_TTL_DAYS * 24 * 60 * 60
+    report = await storage.prune(ads_before, warnings_before)
+    report["bytes"] = await storage.vacuum()
+    # VACUUM переписывает БД через WAL; файл WAL обрезается, чтобы не занимать столько же места
+    await storage.checkpoint("TRUNCATE")
+    # BK-дерево не умеет удалять элементы, поэтому индексы фото перестраиваются по оставшимся объявлениям;
+    # индексы групп без недавних объявлений при этом освобождаются
+    added = photos.indexes.start_rebuild()
+    photo_rows = await storage.get_photo_hashes_since(ads_before)
+    photos.indexes.finish_rebuild(await asyncio.to_thread(photos.build_indexes, photo_rows), added)
+    near_duplicates.prune()
+    # Из фильтров Блума тоже нельзя удалять: они строятся заново без удалённых объявлений
+    await storage.load_text_filters(ads_before)
+    return report
+
+
+async def run_forever():
+    await asyncio.sleep(FIRST_RUN_DELAY_SECONDS)
+    while True:
+        started = time.perf_counter()
+        try:
+            report = await run_once()
+            logger.info(
+                "Очистка БД за %.2f с: удалено объявлений %s, предупреждений %s, блокировок %s, освобождено %.0f КБ",
+                time.perf_counter() - started, report["ads"], report["warnings"], report["bans"], report["bytes"] / 1024
+            )
+        except Exception as e:
+            logger.exception("Ошибка очистки БД: %s", e)
+        await asyncio.sleep(INTERVAL_SECONDS)
+
+
+async def checkpoint_forever():
+    """Периодически переносит WAL в файл БД (автоматический checkpoint SQLite выключен, см. storage)."""
+    if not storage.WAL_PROFILE or not SQLITE_CHECKPOINT_SECONDS:
+        return
+    while True:
+        await asyncio.sleep(SQLITE_CHECKPOINT_SECONDS)
+        try:
+            # PASSIVE не ждёт читающих: страницы, нужные их снимкам, перенесутся в следующий раз
+            await storage.checkpoint()
+        except Exception as e:
+            logger.error("Ошибка checkpoint WAL: %s", e)
@@ -0,0 +1,145 @@
+import asyncio
+import collections
+import functools
+import logging
+import time
+from config import (ADMIN_IDS, bot, LOAD_EXACT_BACKLOG, LOAD_EXACT_DELAY, LOAD_FLOOD_BACKLOG, LOAD_FLOOD_DELAY,
+                    FLOOD_LIMIT, FLOOD_WINDOW_SECONDS)
+from app import outbox, metrics
+
+logger = logging.getLogger(__name__)
+
+# Упрощённые проверки при перегрузке. Нагрузка — число сообщений в обработке и задержка
+# последнего из них (сколько прошло от отправки до начала проверки). Чем она выше, тем дешевле проверки:
+#   FULL  — все проверки;
+#   EXACT — только точные повторы текста (по хэшу) и фото (по photo_id), без схожести текстов,
+#           одинаковых объявлений разных пользователей и перцептивных хэшей фото;
+#   FLOOD — только лимит сообщений одного пользователя (FLOOD_LIMIT за FLOOD_WINDOW_SECONDS), без запросов к БД.
+# Группа остаётся под защитой ценой точности, а удаление нарушений не отстаёт от сообщений.
+# Пропущенные проверки откладываются и выполняются в фоне, когда нагрузка спадает.
+# Более дешёвый режим включается сразу, а возврат к более полному — только если нагрузка
+# COOLDOWN_SECONDS держится ниже его порогов, чтобы режим не переключался на каждом сообщении.
+FULL, EXACT, FLOOD = 0, 1, 2
+TIER_NAMES = {FULL: "полные проверки", EXACT: "только точные повторы", FLOOD: "только лимит сообщений"}
+COOLDOWN_SECONDS = 30
+DEFERRED_LIMIT = 5000  # больше отложенных проверок не хранится: при долгой атаке старые отбрасываются
+RECHECK_INTERVAL_SECONDS = 1
+
+_tier = FULL
+_calm_since = None  # с какого момента нагрузка ниже порогов текущего режима
+_in_flight = 0
+_delay = 0.0
+_deferred = collections.deque(maxlen=DEFERRED_LIMIT)  # (message, album_messages, checked_at, exact_checked)
+_flood = {}  # (chat_id, user_id) -> deque времени сообщений за FLOOD_WINDOW_SECONDS
+_task = None
+
+
+def _target_tier() -> int:
+    if _in_flight >= LOAD_FLOOD_BACKLOG or _delay >= LOAD_FLOOD_DELAY:
+        return FLOOD
+    if _in_flight >= LOAD_EXACT_BACKLOG or _delay >= LOAD_EXACT_DELAY:
+        return EXACT
+    return FULL
+
+
+def _update():
+    global _calm_since
+    target = _target_tier()
+    now = time.monotonic()
+    if target > _tier:
+        _set_tier(target)
+    elif target < _tier:
+        if _calm_since is None:
+            _calm_since = now
+        elif now - _calm_since >= COOLDOWN_SECONDS:
+            _set_tier(_tier - 1)
+    else:
+        _calm_since = None
+
+
+def _set_tier(tier: int):
+    global _tier, _calm_since
+    previous, _tier, _calm_since = _tier, tier, None
+    metrics.inc("load.tier_changes")
+    direction = "Нагрузка выросла" if tier > previous else "Нагрузка снизилась"
+    text = (
+        f"{direction}: в обработке {_in_flight} сообщ., задержка {_delay:.0f} с.\n"
+        f"Режим проверки: {TIER_NAMES[tier]} (был: {TIER_NAMES[previous]}).\n"
+        f"Отложено проверок: {len(_deferred)}."
+    )
+    logger.warning(text.replace("\n", " "), extra={"tier": tier})
+    for admin_id in ADMIN_IDS:
+        outbox.post(functools.partial(bot.send_message, chat_id=int(admin_id), text=text), chat_id=int(admin_id))
+
+
+def begin(sent_at: float) -> int:
+    """Учитывает начало проверки сообщения, отправленного в sent_at, и возвращает режим для него."""
+    global _in_flight, _delay
+    _in_flight += 1
+    _delay = max(time.time() - sent_at, 0.0)
+    _update()
+    if _tier != FULL:
+        metrics.inc("load.degraded")
+    return _tier
+
+
+def end():
+    global _in_flight
+    _in_flight -= 1
+
+
+def flooding(chat_id: int, user_id: int) -> bool:
+    """Учитывает сообщение пользователя и сообщает, превышен ли FLOOD_LIMIT за FLOOD_WINDOW_SECONDS."""
+    now = time.monotonic()
+    times = _flood.setdefault((chat_id, user_id), collections.deque())
+    while times and times[0] <= now - FLOOD_WINDOW_SECONDS:
+        times.popleft()
+    times.append(now)
+    return len(times) > FLOOD_LIMIT
+
+
+def defer(message, album_messages: list, checked_at: int, exact_checked: bool):
+    """Откладывает пропущенные проверки сообщения, упрощённо проверенного в checked_at, до снижения
+       нагрузки. exact_checked — точные проверки уже выполнены и объявление сохранено."""
+    if len(_deferred) == _deferred.maxlen:
+        metrics.inc("load.deferred_dropped")
+    _deferred.append((message, album_messages, checked_at, exact_checked))
+    metrics.inc("load.deferred")
+
+
+def status() -> str:
+    """Строка для /perf."""
+    return (f"Режим проверки: {TIER_NAMES[_tier]}; в обработке {_in_flight} сообщ., "
+            f"задержка {_delay:.1f} с, отложено проверок {len(_deferred)}")
+
+
+async def _recheck_forever(recheck):
+    global _delay
+    while True:
+        await asyncio.sleep(RECHECK_INTERVAL_SECONDS)
+        if _in_flight == 0:
+            # Новых сообщений нет — и задержки нет; без этого режим не вернулся бы к полному
+            _delay = 0.0
+        _update()
+        if _flood:
+            now = time.monotonic()
+            for key in [key for key, times in _flood.items() if not times or times[-1] <= now - FLOOD_WINDOW_SECONDS]:
+                del _flood[key]
+        # Отложенные проверки — только при полной проверке и по одной, чтобы не создать нагрузку заново
+        while _deferred and _tier == FULL and _in_flight < LOAD_EXACT_BACKLOG // 2:
+            message, album_messages, checked_at, exact_checked = _deferred.popleft()
+            try:
+                await recheck(message, album_messages, checked_at, exact_checked)
+                metrics.inc("load.rechecked")
+            except Exception as e:
+                logger.exception(
+                    "Ошибка отложенной проверки: %s", e,
+                    extra={"chat_id": message.chat.id, "user_id": message.from_user.id, "message_id": message.message_id}
+                )
+
+
+def start(recheck):
+    """Запускает фоновую проверку отложенных сообщений: recheck(message, album_messages, checked_at, exact_checked)."""
+    global _task
+    _task = asyncio.create_task(_recheck_forever(recheck))
+    return _task
@@ -0,0 +1,35 @@
+import asyncio
+import contextlib
+from app import metrics
+
+# Блокировки по ключу, например (chat_id, user_id). Сообщения одного пользователя
+# проверяются строго по очереди (asyncio.Lock пропускает ожидающих в порядке прихода),
+# поэтому два быстрых одинаковых объявления не проходят проверку одновременно;
+# сообщения разных пользователей обрабатываются параллельно. Запись удаляется,
+# как только ключ никто не держит и не ждёт, так что словарь не растёт.
+
+_locks = {}  # ключ -> _Entry
+
+
+class _Entry:
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0  # сколько задач держат блокировку или ждут её
+
+
+@contextlib.asynccontextmanager
+async def hold(key):
+    """Выполняет блок, пока другие задачи с тем же ключом ждут."""
+    entry = _locks.get(key)
+    if entry is None:
+        entry = _locks[key] = _Entry()
+    elif entry.lock.locked():
+        metrics.inc("locks.waits")
+    entry.users += 1
+    try:
+        async with entry.lock:
+            yield
+    finally:
+        entry.users -= 1
+        if entry.users == 0:
+            del _locks[key]
@@ -0,0 +1,80 @@
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+from config import LOG_LEVEL, LOG_FILE, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_DEBUG_SAMPLE_RATE
+from app import metrics
+
+# Журнал. Цикл событий только кладёт запись в очередь (QueueHandler), а форматирование
+# и запись в файл и консоль выполняет отдельный поток (QueueListener), поэтому запись на диск
+# не задерживает модерацию. Если очередь переполнена (например, диск не успевает во время атаки),
+# записи отбрасываются и учитываются в счётчике log.dropped, а не ждут места.
+# Записи DEBUG (например, о каждом проверенном сообщении) попадают в журнал с вероятностью
+# LOG_DEBUG_SAMPLE_RATE. В файл пишется JSON, по записи на строку; файл ротируется по размеру.
+QUEUE_SIZE = 10000
+# Поля контекста, которые передаются через extra и попадают в JSON
+CONTEXT_FIELDS = ("chat_id", "user_id", "thread_id", "message_id", "decision", "tier", "stages_ms", "duration_ms")
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class _SamplingFilter(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno > logging.DEBUG or random.random() < LOG_DEBUG_SAMPLE_RATE
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.inc("log.dropped")
+
+
+def setup():
+    """Настраивает журнал для всех модулей (включая aiogram) и запускает поток записи."""
+    global _listener
+    handlers = []
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    handlers.append(console)
+    if LOG_FILE:
+        file_handler = logging.handlers.RotatingFileHandler(
+            LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding="utf-8"
+        )
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+
+    queue_handler = _DroppingQueueHandler(queue.Queue(QUEUE_SIZE))
+    queue_handler.addFilter(_SamplingFilter())
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+    _listener = logging.handlers.QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    _listener.start()
+
+
+def stop():
+    """Записывает оставшиеся в очереди записи и останавливает поток записи."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
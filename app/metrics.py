@@ -0,0 +1,143 @@
+import bisect
+import contextlib
+import contextvars
+import functools
+import time
+
+# Метрики в памяти процесса: гистограммы длительности этапов обработки (span)
+# и счётчики событий (inc). Сводка выводится командой /perf, при заданном PROMETHEUS_PORT
+# те же данные отдаются в текстовом формате Prometheus.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)  # границы, сек.
+
+started = time.time()
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # последняя корзина — больше BUCKETS[-1]
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, fraction: float) -> float:
+        """Оценка квантиля сверху: граница корзины, в которую он попадает."""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(BUCKETS[i], self.max) if i < len(BUCKETS) else self.max
+        return self.max
+
+
+histograms = {}
+counters = {}
+# Длительности этапов обрабатываемого сообщения {этап: секунды} — для записи о нём в журнале.
+# Задаётся в обработчике сообщения; span добавляет сюда время, измеренное в той же задаче.
+current_stages = contextvars.ContextVar("current_stages", default=None)
+
+
+def observe(name: str, seconds: float):
+    histogram = histograms.get(name)
+    if histogram is None:
+        histogram = histograms[name] = Histogram()
+    histogram.observe(seconds)
+
+
+def inc(name: str, value: int = 1):
+    counters[name] = counters.get(name, 0) + value
+
+
+@contextlib.contextmanager
+def span(name: str):
+    """Замеряет длительность блока, в том числе с await внутри: with metrics.span("similarity"): ..."""
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started_at
+        observe(name, elapsed)
+        stages = current_stages.get()
+        if stages is not None:
+            stages[name] = stages.get(name, 0.0) + elapsed
+
+
+def timed(name: str):
+    """Декоратор для async-функции: замеряет длительность каждого вызова."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def reset():
+    histograms.clear()
+    counters.clear()
+
+
+def summary() -> str:
+    """Краткая сводка для /perf."""
+    uptime = int(time.time() - started)
+    lines = [f"Метрики за {uptime // 3600} ч {uptime % 3600 // 60} мин"]
+    if histograms:
+        lines.append("\nЭтап: вызовов, p50 / p95 / макс., мс")
+        for name in sorted(histograms):
+            h = histograms[name]
+            lines.append(
+                f"{name}: {h.count}, {h.quantile(0.5) * 1000:.0f} / {h.quantile(0.95) * 1000:.0f} / {h.max * 1000:.0f}"
+            )
+    if counters:
+        lines.append("\nСчётчики:")
+        lines.extend(f"{name}: {counters[name]}" for name in sorted(counters))
+    return "\n".join(lines)
+
+
+def _metric_name(name: str) -> str:
+    return "bot_" + "".join(c if c.isalnum() else "_" for c in name)
+
+
+def prometheus() -> str:
+    """Метрики в текстовом формате Prometheus."""
+    lines = []
+    for name in sorted(histograms):
+        h = histograms[name]
+        metric = _metric_name(name) + "_seconds"
+        lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, count in zip(BUCKETS, h.counts):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {h.count}')
+        lines.append(f"{metric}_sum {h.sum}")
+        lines.append(f"{metric}_count {h.count}")
+    for name in sorted(counters):
+        metric = _metric_name(name) + "_total"
+        lines.append(f"# TYPE {metric} counter")
+        lines.append(f"{metric} {counters[name]}")
+    return "\n".join(lines) + "\n"
+
+
+async def start_server(port: int, host: str = "127.0.0.1"):
+    """Запускает HTTP-сервер с метриками по адресу http://host:port/metrics. Возвращает runner для остановки."""
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=prometheus(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,144 @@
+import collections
+import time
+import zlib
+from app.chat_indexes import ChatIndexes
+
+# Индекс почти одинаковых объявлений разных пользователей (MinHash + LSH).
+# Текст разбивается на символьные n-граммы, по ним считается MinHash-сигнатура,
+# а сигнатура режется на полосы: тексты, совпавшие хотя бы в одной полосе, становятся кандидатами.
+# Поиск смотрит только в корзины своих полос, поэтому не зависит от общего числа объявлений.
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5
+THRESHOLD = 0.7  # оценка схожести Жаккара, начиная с которой объявления считаются одинаковыми
+WINDOW_SECONDS = 10 * 24 * 60 * 60  # максимальная периодичность рекламы (/sdays)
+
+_PRIME = (1 << 61) - 1
+
+# numpy импортируется при первом обращении к индексу, чтобы не задерживать запуск бота
+np = None
+_A = None
+_B = None
+
+
+def _load():
+    global np, _A, _B
+    if np is not None:
+        return
+    import numpy
+    random = numpy.random.RandomState(20240601)
+    _A = random.randint(1, 1 << 31, size=NUM_PERM).astype(numpy.uint64)
+    _B = random.randint(0, 1 << 31, size=NUM_PERM).astype(numpy.uint64)
+    np = numpy
+
+
+def signature(text: str):
+    """MinHash-сигнатура нормализованного текста (numpy-массив из NUM_PERM чисел)."""
+    _load()
+    if len(text) <= SHINGLE_SIZE:
+        shingles = {text}
+    else:
+        shingles = {text[i:i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode()) for s in shingles), dtype=np.uint64, count=len(shingles))
+    return ((hashes[:, None] * _A + _B) % _PRIME).min(axis=0)
+
+
+class NearDuplicateIndex:
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._entries = {}  # key -> (signature, (user_id, thread_id, timestamp, text))
+        self._buckets = [collections.defaultdict(set) for _ in range(BANDS)]
+        self._order = collections.deque()  # ключи по возрастанию времени, для удаления устаревших
+        self._next_key = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _bands(self, sig):
+        for band in range(BANDS):
+            yield band, sig[band * ROWS:(band + 1) * ROWS].tobytes()
+
+    def _evict(self, now: int):
+        while self._order:
+            key = self._order[0]
+            sig, (_, _, timestamp, _) = self._entries[key]
+            if timestamp >= now - WINDOW_SECONDS:
+                break
+            self._order.popleft()
+            del self._entries[key]
+            for band, band_key in self._bands(sig):
+                bucket = self._buckets[band][band_key]
+                bucket.discard(key)
+                if not bucket:
+                    del self._buckets[band][band_key]
+
+    def add(self, user_id: int, thread_id: int, text: str, timestamp: int):
+        if not text:
+            return
+        self._evict(int(time.time()))
+        key = self._next_key
+        self._next_key += 1
+        sig = signature(text)
+        self._entries[key] = (sig, (user_id, thread_id, timestamp, text))
+        self._order.append(key)
+        for band, band_key in self._bands(sig):
+            self._buckets[band][band_key].add(key)
+
+    def query(self, user_id: int, text: str, since: int):
+        """Ищет самое похожее объявление другого пользователя, размещённое не раньше since.
+           Возвращает (схожесть, (user_id, thread_id, timestamp, text)) или None."""
+        if not text or not self._entries:
+            return None
+        sig = signature(text)
+        candidates = set()
+        for band, band_key in self._bands(sig):
+            candidates.update(self._buckets[band].get(band_key, ()))
+
+        best = None
+        for key in candidates:
+            other_sig, ad = self._entries[key]
+            if ad[0] == user_id or ad[2] < since:
+                continue
+            similarity = float(np.count_nonzero(other_sig == sig)) / NUM_PERM
+            if similarity >= THRESHOLD and (best is None or similarity > best[0]):
+                best = (similarity, ad)
+        return best
+
+
+# Индексы по группам (app/chat_indexes.py); память занимают только группы с объявлениями за WINDOW_SECONDS
+indexes = ChatIndexes(NearDuplicateIndex)
+
+
+def build_indexes(rows) -> dict:
+    """Строит индексы групп по строкам (chat_id, user_id, thread_id, text, timestamp) в порядке времени."""
+    return indexes.build(rows)
+
+
+def add(chat_id: int, user_id: int, thread_id: int, text: str, timestamp: int):
+    if not text:
+        return
+    indexes.add(chat_id, user_id, thread_id, text, timestamp)
+
+
+def query(chat_id: int, user_id: int, text: str, since: int):
+    """Поиск в индексе группы, см. NearDuplicateIndex.query."""
+    chat_index = indexes.get(chat_id)
+    if chat_index is None:
+        return None
+    return chat_index.query(user_id, text, since)
+
+
+def prune():
+    """Удаляет устаревшие объявления и индексы групп, в которых их не осталось."""
+    now = int(time.time())
+    for chat_id, chat_index in list(indexes.by_chat.items()):
+        chat_index._evict(now)
+        if not len(chat_index):
+            del indexes.by_chat[chat_id]
+
+
+def size() -> int:
+    return sum(len(chat_index) for chat_index in indexes.by_chat.values())
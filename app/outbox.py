@@ -0,0 +1,246 @@
+import asyncio
+import collections
+import functools
+import itertools
+import logging
+import time
+from aiogram.exceptions import TelegramRetryAfter
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# Очередь исходящих запросов к Telegram. Все сообщения бота проходят через общие ограничители
+# скорости (token bucket) с лимитами Telegram, отправляются несколькими обработчиками параллельно
+# и повторяются после TelegramRetryAfter. Запросы модерации (ответы, удаления, блокировки)
+# обрабатываются раньше уведомлений администраторам.
+# Обработчики не ждут лимита чата: если в чате нет свободного жетона, сообщение откладывается
+# в очередь этого чата и возвращается в общую очередь, когда жетон появится. Так ответы
+# в одну группу во время атаки не задерживают удаления и ограничения прав в других местах.
+MODERATION = 0
+NOTIFICATION = 1
+
+WORKERS = 8
+MAX_RETRIES = 3
+GLOBAL_RATE = 30  # сообщений в секунду для всего бота
+PRIVATE_CHAT_RATE = 1  # сообщений в секунду в личный чат
+GROUP_CHAT_RATE = 20 / 60  # сообщений в секунду в группу (20 в минуту)
+COALESCE_SECONDS = 30  # сколько ждёт объединяемое уведомление, прежде чем уйти в очередь
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_time(self) -> float:
+        """Через сколько секунд появится жетон."""
+        self._refill()
+        return max(1 - self.tokens, 0) / self.rate
+
+    async def acquire(self):
+        while not self.try_acquire():
+            await asyncio.sleep(self.wait_time())
+
+
+class _Job:
+    def __init__(self, factory, chat_id, future=None, coalesce_key=None):
+        self.factory = factory
+        self.chat_id = chat_id
+        self.future = future
+        self.coalesce_key = coalesce_key
+        self.merged = 0
+        self.handle = None  # отложенная постановка в очередь объединяемого запроса
+        self.queued = time.monotonic()
+        self.has_chat_token = False  # жетон чата уже получен при возврате из очереди чата
+
+
+_queue = None
+_workers = []
+_sequence = itertools.count()
+_global_bucket = TokenBucket(GLOBAL_RATE, GLOBAL_RATE)
+_chat_buckets = {}
+_pending = {}  # coalesce_key -> _Job, ещё не отправленные объединяемые уведомления
+_parked = {}  # chat_id -> deque((priority, sequence, job)), сообщения, ждущие жетона чата
+
+
+def _chat_bucket(chat_id: int) -> TokenBucket:
+    bucket = _chat_buckets.get(chat_id)
+    if bucket is None:
+        if len(_chat_buckets) > 1000:
+            # Полные корзины ничем не отличаются от новых — их можно забыть
+            for key in [key for key, value in _chat_buckets.items() if value.is_full()]:
+                del _chat_buckets[key]
+        if chat_id < 0:
+            bucket = TokenBucket(GROUP_CHAT_RATE, 20)
+        else:
+            bucket = TokenBucket(PRIVATE_CHAT_RATE, 1)
+        _chat_buckets[chat_id] = bucket
+    return bucket
+
+
+def _method_name(factory) -> str:
+    func = getattr(factory, "func", factory)  # functools.partial
+    return getattr(func, "__name__", "call").lstrip("_")
+
+
+def _park(item):
+    """Откладывает сообщение до появления жетона чата; порядок сообщений в чате сохраняется."""
+    chat_id = item[2].chat_id
+    waiting = _parked.get(chat_id)
+    if waiting is None:
+        waiting = _parked[chat_id] = collections.deque()
+        asyncio.get_running_loop().call_later(_chat_bucket(chat_id).wait_time(), _release, chat_id)
+    waiting.append(item)
+    metrics.inc("outbox.parked")
+
+
+def _release(chat_id: int):
+    """Возвращает в общую очередь первое отложенное сообщение чата, как только есть жетон."""
+    waiting = _parked[chat_id]
+    bucket = _chat_bucket(chat_id)
+    if bucket.try_acquire():
+        item = waiting.popleft()
+        item[2].has_chat_token = True
+        _queue.put_nowait(item)
+    if waiting:
+        asyncio.get_running_loop().call_later(bucket.wait_time(), _release, chat_id)
+    else:
+        del _parked[chat_id]
+
+
+def _ensure_started():
+    global _queue
+    if _queue is None:
+        _queue = asyncio.PriorityQueue()
+    if not _workers:
+        for _ in range(WORKERS):
+            _workers.append(asyncio.create_task(_worker()))
+
+
+async def _execute(job: _Job):
+    metrics.observe("outbox.wait", time.monotonic() - job.queued)
+    name = "telegram." + _method_name(job.factory)
+    if job.coalesce_key is not None:
+        _pending.pop(job.coalesce_key, None)
+        call = functools.partial(job.factory, job.merged)
+    else:
+        call = job.factory
+    for attempt in range(MAX_RETRIES + 1):
+        await _global_bucket.acquire()
+        if attempt > 0 and job.chat_id is not None:
+            await _chat_bucket(job.chat_id).acquire()
+        try:
+            with metrics.span(name):
+                return await call()
+        except TelegramRetryAfter as e:
+            metrics.inc("telegram.retry_after")
+            if attempt == MAX_RETRIES:
+                raise
+            logger.warning("Превышен лимит Telegram, повтор через %s с", e.retry_after, extra={"chat_id": job.chat_id})
+            await asyncio.sleep(e.retry_after)
+
+
+async def _worker():
+    # Обработчики запускаются при первом запросе и наследуют контекст сообщения —
+    # без сброса время отправки всех запросов приписывалось бы этому сообщению
+    metrics.current_stages.set(None)
+    while True:
+        item = await _queue.get()
+        job = item[2]
+        if job.chat_id is not None and not job.has_chat_token:
+            # Сообщения чата, который уже ждёт жетона, встают за ними, чтобы не обгонять их
+            if job.chat_id in _parked or not _chat_bucket(job.chat_id).try_acquire():
+                _park(item)
+                _queue.task_done()
+                continue
+        try:
+            result = await _execute(job)
+            if job.future is not None and not job.future.done():
+                job.future.set_result(result)
+        except Exception as e:
+            if job.future is not None:
+                if not job.future.done():
+                    job.future.set_exception(e)
+            else:
+                logger.error("Не удалось отправить сообщение: %s", e, extra={"chat_id": job.chat_id})
+        finally:
+            _queue.task_done()
+
+
+async def call(factory, chat_id: int = None, priority: int = MODERATION):
+    """Выполняет запрос factory() через очередь и возвращает его результат (или бросает его исключение).
+       chat_id — чат, в который уходит сообщение (для лимита на чат); None — запрос не является
+       сообщением (удаление, ограничение прав) и учитывается только в общем лимите."""
+    _ensure_started()
+    future = asyncio.get_running_loop().create_future()
+    _queue.put_nowait((priority, next(_sequence), _Job(factory, chat_id, future)))
+    return await future
+
+
+def post(factory, chat_id: int = None, priority: int = NOTIFICATION, coalesce_key=None):
+    """Ставит запрос factory() в очередь, не дожидаясь отправки; ошибки выводятся в лог.
+       Если указан coalesce_key, запрос ждёт COALESCE_SECONDS, и все запросы с тем же ключом
+       за это время объединяются в один: отправляется последний, а factory вызывается
+       с числом объединённых до него запросов — factory(merged)."""
+    _ensure_started()
+    if coalesce_key is None:
+        _queue.put_nowait((priority, next(_sequence), _Job(factory, chat_id)))
+        return
+
+    job = _pending.get(coalesce_key)
+    if job is not None:
+        job.factory = factory
+        job.merged += 1
+        return
+    job = _Job(factory, chat_id, coalesce_key=coalesce_key)
+    _pending[coalesce_key] = job
+    job.handle = asyncio.get_running_loop().call_later(COALESCE_SECONDS, _enqueue_delayed, priority, job)
+
+
+def _enqueue_delayed(priority: int, job: _Job):
+    job.handle = None
+    job.queued = time.monotonic()
+    _queue.put_nowait((priority, next(_sequence), job))
+
+
+async def _drain():
+    while True:
+        await _queue.join()
+        if not _parked:
+            return
+        await asyncio.sleep(min(_chat_bucket(chat_id).wait_time() for chat_id in _parked))
+
+
+async def close(timeout: float = 10):
+    """Дожидается отправки поставленных в очередь запросов (не дольше timeout) и останавливает обработчики."""
+    # Отложенные объединяемые уведомления отправляются сразу
+    for job in list(_pending.values()):
+        if job.handle is not None:
+            job.handle.cancel()
+            _enqueue_delayed(NOTIFICATION, job)
+    if _queue is not None:
+        try:
+            await asyncio.wait_for(_drain(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Не все исходящие сообщения были отправлены до остановки")
+    for task in _workers:
+        task.cancel()
+    _workers.clear()
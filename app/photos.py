@@ -0,0 +1,184 @@
+import io
+import logging
+import os
+from app import workers
+from app.chat_indexes import ChatIndexes
+
+logger = logging.getLogger(__name__)
+
+try:
+    from PIL import Image
+except ImportError:  # без Pillow фото сравниваются только по file_unique_id
+    Image = None
+
+# Отпечатки фотографий: помимо file_unique_id считается перцептивный хэш (dHash, 64 бита)
+# уменьшенной копии фото. У пересжатой или слегка обрезанной копии хэш отличается
+# на несколько бит, поэтому похожие фото ищутся по расстоянию Хэмминга в BK-дереве.
+MAX_DISTANCE = 6  # максимальное число отличающихся бит, при котором фото считаются одинаковыми
+
+
+class TelegramPhotoSource:
+    """Скачивает фото через Bot API."""
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    async def fetch(self, photo) -> bytes:
+        buffer = await self.bot.download(photo.file_id, destination=io.BytesIO())
+        return buffer.getvalue()
+
+
+class LocalPhotoSource:
+    """Читает фото из папки по file_unique_id (<directory>/<file_unique_id>.jpg). Для тестов и бенчмарков."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    async def fetch(self, photo) -> bytes:
+        with open(os.path.join(self.directory, f"{photo.file_unique_id}.jpg"), "rb") as f:
+            return f.read()
+
+
+# Источник фото задаётся при старте (set_source); None — перцептивный хэш не считается
+source = None
+
+
+def set_source(photo_source):
+    global source
+    source = photo_source
+
+
+def dhash(data: bytes) -> int:
+    """64-битный разностный хэш изображения."""
+    image = Image.open(io.BytesIO(data)).convert("L").resize((9, 8), Image.LANCZOS)
+    pixels = list(image.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = (value << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def to_db(value: int) -> int:
+    """Хэш для колонки INTEGER (знаковое 64-битное число в SQLite)."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def from_db(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+async def fingerprint(photo_sizes) -> int:
+    """Перцептивный хэш фото из сообщения (по самой маленькой копии) или None,
+       если хэш посчитать нельзя: не задан источник, нет Pillow или фото не скачалось."""
+    if source is None or Image is None or not photo_sizes:
+        return None
+    try:
+        data = await source.fetch(photo_sizes[0])
+        return await workers.run(dhash, data)
+    except Exception as e:
+        logger.warning("Не удалось получить отпечаток фото: %s", e)
+        return None
+
+
+class BKTree:
+    """BK-дерево по расстоянию Хэмминга: поиск всех хэшей в радиусе r
+       обходит только ветви, которые могут содержать такие хэши."""
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self._root = None  # [hash, [items], {distance: child}]
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, value: int, item):
+        self._size += 1
+        if self._root is None:
+            self._root = [value, [item], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value, [item], {}]
+                return
+            node = child
+
+    def search(self, value: int, radius: int):
+        """Возвращает список (расстояние, item) для всех хэшей на расстоянии не больше radius."""
+        found = []
+        if self._root is None:
+            return found
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            distance = hamming(value, node[0])
+            if distance <= radius:
+                found.extend((distance, item) for item in node[1])
+            for child_distance, child in node[2].items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+class PhotoIndex:
+    """Отпечатки фото из объявлений: item — (user_id, thread_id, timestamp, photo_id)."""
+
+    def __init__(self):
+        self.tree = BKTree()
+
+    def add(self, user_id: int, thread_id: int, photo_id: str, photo_hash: int, timestamp: int):
+        if photo_hash is not None:
+            self.tree.add(photo_hash, (user_id, thread_id, timestamp, photo_id))
+
+    def find(self, user_id: int, photo_hash: int, since: int):
+        """Самое похожее фото пользователя, размещённое не раньше since: (расстояние, item) или None."""
+        best = None
+        for distance, item in self.tree.search(photo_hash, MAX_DISTANCE):
+            if item[0] != user_id or item[2] < since:
+                continue
+            if best is None or distance < best[0]:
+                best = (distance, item)
+        return best
+
+
+# Индексы по группам (app/chat_indexes.py), создаются при первом фото с отпечатком в группе
+indexes = ChatIndexes(PhotoIndex)
+
+
+def build_indexes(rows) -> dict:
+    """Строит индексы групп по строкам (chat_id, user_id, thread_id, photo_id, photo_hash, timestamp)."""
+    return indexes.build(
+        (chat_id, user_id, thread_id, photo_id, from_db(photo_hash), timestamp)
+        for chat_id, user_id, thread_id, photo_id, photo_hash, timestamp in rows
+    )
+
+
+def add(chat_id: int, user_id: int, thread_id: int, photo_id: str, photo_hash: int, timestamp: int):
+    if photo_hash is None:
+        return
+    indexes.add(chat_id, user_id, thread_id, photo_id, photo_hash, timestamp)
+
+
+def find(chat_id: int, user_id: int, photo_hash: int, since: int):
+    """Поиск в индексе группы, см. PhotoIndex.find."""
+    chat_index = indexes.get(chat_id)
+    if chat_index is None:
+        return None
+    return chat_index.find(user_id, photo_hash, since)
+
+
+def size() -> int:
+    return sum(len(chat_index.tree) for chat_index in indexes.by_chat.values())
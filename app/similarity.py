@@ -0,0 +1,128 @@
+import math
+
+# Пороги схожести текстов
+SIMILARITY_THRESHOLD = 0.75  # не ниже — нарушение
+SUSPICIOUS_THRESHOLD = 0.35  # от этого значения до SIMILARITY_THRESHOLD — уведомление администраторам
+
+# Раньше для каждой пары (предыдущее объявление, новое сообщение) обучался отдельный
+# TfidfVectorizer на двух документах. Для двух документов idf слова равен 1, если оно
+# встречается в обоих, и 1 + ln(3/2), если только в одном. Поэтому косинус той пары
+# выражается через частоты слов, и все пары считаются одной матричной операцией
+# с тем же результатом, что и у TfidfVectorizer + cosine_similarity.
+_IDF_UNIQUE = 1 + math.log(1.5)
+
+# Частоты слов хранятся в пространстве фиксированной размерности (хэширование слов),
+# поэтому вектор объявления считается один раз при сохранении и не зависит от других текстов.
+# Токенизатор тот же, что у TfidfVectorizer по умолчанию.
+N_FEATURES = 2 ** 20
+
+# numpy, scipy и sklearn импортируются при первой проверке (или при прогреве, см. load),
+# чтобы не задерживать запуск бота
+np = None
+sp = None
+_vectorizer = None
+
+
+def load():
+    """Загружает numpy/scipy/sklearn и создаёт векторизатор. Повторные вызовы ничего не делают."""
+    global np, sp, _vectorizer
+    if _vectorizer is not None:
+        return
+    import numpy
+    import scipy.sparse
+    from sklearn.feature_extraction.text import HashingVectorizer
+    np, sp = numpy, scipy.sparse
+    _vectorizer = HashingVectorizer(n_features=N_FEATURES, alternate_sign=False, norm=None, dtype=numpy.float64)
+
+
+def vectorize(text: str) -> bytes:
+    """Вектор частот слов нормализованного текста в виде BLOB для колонки ads.features:
+       индексы (int32) и следом частоты (float32)."""
+    load()
+    row = _vectorizer.transform([text])
+    return row.indices.astype("<i4").tobytes() + row.data.astype("<f4").tobytes()
+
+
+def _to_matrix(blobs: list):
+    indptr = [0]
+    indices = []
+    data = []
+    for blob in blobs:
+        size = len(blob) // 8
+        indices.append(np.frombuffer(blob, dtype="<i4", count=size))
+        data.append(np.frombuffer(blob, dtype="<f4", count=size, offset=size * 4))
+        indptr.append(indptr[-1] + size)
+    return sp.csr_matrix(
+        (np.concatenate(data).astype(np.float64) if data else np.zeros(0),
+         np.concatenate(indices) if indices else np.zeros(0, dtype=np.int32),
+         indptr),
+        shape=(len(blobs), N_FEATURES)
+    )
+
+
+def _pairwise_tfidf_cosine(previous_counts, current_counts):
+    """Косинусная схожесть TF-IDF нового сообщения (current_counts, 1 x V) с каждым
+       предыдущим (previous_counts, N x V), как если бы каждая пара векторизовалась отдельно."""
+    c2 = _IDF_UNIQUE ** 2
+    current_presence = (current_counts > 0).astype(np.float64)
+    current_squares = current_counts.multiply(current_counts)
+
+    # Скалярное произведение: вклад дают только общие слова, их idf равен 1
+    dot = np.asarray((previous_counts @ current_counts.T).todense()).ravel()
+
+    # Квадраты норм: общие слова с весом 1, остальные — с весом c2
+    previous_total = np.asarray(previous_counts.multiply(previous_counts).sum(axis=1)).ravel()
+    previous_shared = np.asarray((previous_counts.multiply(previous_counts) @ current_presence.T).todense()).ravel()
+    previous_norm = c2 * previous_total - (c2 - 1) * previous_shared
+
+    current_total = current_squares.sum()
+    current_shared = np.asarray(((previous_counts > 0).astype(np.float64) @ current_squares.T).todense()).ravel()
+    current_norm = c2 * current_total - (c2 - 1) * current_shared
+
+    denominator = np.sqrt(previous_norm * current_norm)
+    scores = np.zeros_like(dot)
+    np.divide(dot, denominator, out=scores, where=denominator > 0)
+    return scores
+
+
+def score_features(features: bytes, previous_features: list) -> list:
+    """Схожесть вектора сообщения с каждым из предыдущих векторов (список чисел от 0 до 1)."""
+    if not previous_features:
+        return []
+    load()
+    matrix = _to_matrix(list(previous_features) + [features])
+    return _pairwise_tfidf_cosine(matrix[:-1], matrix[-1]).tolist()
+
+
+def score_texts(text: str, previous_texts: list) -> list:
+    """Схожесть текста с каждым из предыдущих текстов (список чисел от 0 до 1)."""
+    return score_features(vectorize(text), [vectorize(previous_text) for previous_text in previous_texts])
+
+
+def find_similar(features: bytes, previous_ads: list):
+    """Сравнивает вектор нового сообщения (см. vectorize) с текстовыми объявлениями пользователя
+       (строки вида (text, photo_id, timestamp, thread_id, features); объявления с фото не учитываются).
+       Для старых записей без сохранённого вектора он считается по тексту.
+       Возвращает (best_match, suspicious_matches):
+       best_match — (схожесть, объявление) с наибольшей схожестью не ниже SIMILARITY_THRESHOLD или None;
+       suspicious_matches — список (схожесть, объявление) в диапазоне [SUSPICIOUS_THRESHOLD, SIMILARITY_THRESHOLD)."""
+    candidates = [ad for ad in previous_ads if ad[0] and not ad[1]]
+    scores = score_features(features, [ad[4] if ad[4] is not None else vectorize(ad[0]) for ad in candidates])
+
+    best_match = None
+    suspicious_matches = []
+    for similarity, ad in zip(scores, candidates):
+        if similarity >= SIMILARITY_THRESHOLD:
+            if best_match is None or similarity > best_match[0]:
+                best_match = (similarity, ad)
+        elif similarity >= SUSPICIOUS_THRESHOLD:
+            suspicious_matches.append((similarity, ad))
+    return best_match, suspicious_matches
+
+
+def check_text(text: str, previous_ads: list):
+    """Полная проверка текста для пула проверок (app/workers.py): векторизует нормализованный текст
+       и сравнивает его с объявлениями пользователя. Возвращает (features, best_match, suspicious_matches)."""
+    features = vectorize(text)
+    best_match, suspicious_matches = find_similar(features, previous_ads)
+    return features, best_match, suspicious_matches
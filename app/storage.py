@@ -0,0 +1,794 @@
+import asyncio
+import logging
+import pathlib
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import (DB_PATH, SQLITE_PROFILE, SQLITE_READERS, SQLITE_MMAP_SIZE_MB, SQLITE_CACHE_SIZE_MB,
+                    SQLITE_CHECKPOINT_SECONDS, SQLITE_INTEGRITY_CHECK)
+from app import metrics, hashing
+
+logger = logging.getLogger(__name__)
+
+# Одно долгоживущее соединение для записи. Все запросы выполняются в отдельных потоках,
+# чтобы ожидание диска не останавливало цикл событий aiogram.
+# Поток записи один: sqlite3-соединение не рассчитано на одновременное использование из нескольких потоков.
+#
+# В профиле "wal" (SQLITE_PROFILE) БД работает в режиме WAL: чтение идёт из снимка и не ждёт записи.
+# Запросы на чтение выполняются в отдельном пуле из SQLITE_READERS потоков, у каждого своё
+# соединение только для чтения, поэтому выборки не стоят в очереди за записью во время всплесков.
+# Автоматический checkpoint (перенос WAL в файл БД) выключен, чтобы он не задерживал запись
+# случайного сообщения; вместо этого checkpoint выполняется раз в SQLITE_CHECKPOINT_SECONDS (janitor).
+# В профиле "default" используются настройки sqlite3 по умолчанию и одно соединение на всё.
+WAL_PROFILE = SQLITE_PROFILE == "wal"
+JOURNAL_SIZE_LIMIT = 64 * 1024 * 1024  # до какого размера обрезается файл WAL после checkpoint, байт
+
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="storage")
+_read_executor = ThreadPoolExecutor(max_workers=SQLITE_READERS, thread_name_prefix="storage-read") if WAL_PROFILE else None
+_conn = None
+_read_local = threading.local()
+_read_conns = []
+
+# Кэш настроек тем: chat_id -> {thread_id -> dict}. Темы группы загружаются одним запросом
+# при первом обращении к ней (load_topics), поэтому память тратится только на активные группы.
+# Кэш обновляется функциями этого модуля сразу после записи в БД, и обработка сообщений читает
+# настройки из памяти без обращения к БД. Словарь настроек при изменении заменяется целиком.
+_topics = {}
+
+DEFAULT_TOPIC_SETTINGS = {
+    "enabled": True,
+    "block_days": 5,
+    "warnings_limit": 3,
+    "ad_frequency_days": 5,
+    "cross_user_action": "notify"
+}
+
+# Допустимые действия при совпадении с объявлением другого пользователя
+CROSS_USER_ACTIONS = ("notify", "warn", "off")
+
+
+def _connect(read_only: bool = False) -> sqlite3.Connection:
+    if read_only:
+        conn = sqlite3.connect(pathlib.Path(DB_PATH).resolve().as_uri() + "?mode=ro", uri=True, check_same_thread=False)
+    else:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+    if WAL_PROFILE:
+        conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE_MB * 1024 * 1024}")
+        conn.execute(f"PRAGMA cache_size = {-SQLITE_CACHE_SIZE_MB * 1024}")  # отрицательное значение — в КиБ
+        if not read_only:
+            conn.execute("PRAGMA journal_mode = WAL")
+            # В режиме WAL при NORMAL сбой питания может откатить последние транзакции, но не повредить БД
+            conn.execute("PRAGMA synchronous = NORMAL")
+            conn.execute(f"PRAGMA journal_size_limit = {JOURNAL_SIZE_LIMIT}")
+            if SQLITE_CHECKPOINT_SECONDS:
+                conn.execute("PRAGMA wal_autocheckpoint = 0")
+    return conn
+
+
+def _get_conn() -> sqlite3.Connection:
+    global _conn
+    if _conn is None:
+        _conn = _connect()
+    return _conn
+
+
+def _get_read_conn() -> sqlite3.Connection:
+    """Соединение для чтения текущего потока: своё в профиле "wal", иначе общее."""
+    if not WAL_PROFILE:
+        return _get_conn()
+    conn = getattr(_read_local, "conn", None)
+    if conn is None:
+        conn = _read_local.conn = _connect(read_only=True)
+        _read_conns.append(conn)
+    return conn
+
+
+async def _run(func, *args):
+    loop = asyncio.get_running_loop()
+    # Время запроса вместе с ожиданием в очереди потока хранилища
+    with metrics.span("db." + func.__name__.lstrip("_")):
+        return await loop.run_in_executor(_executor, func, *args)
+
+
+async def _read(func, *args):
+    """Выполняет запрос только на чтение: в профиле "wal" — в пуле чтения, параллельно с записью."""
+    if not WAL_PROFILE:
+        return await _run(func, *args)
+    if _conn is None:
+        # Соединение для записи включает WAL; соединения только для чтения открываются после него
+        await _run(_get_conn)
+    loop = asyncio.get_running_loop()
+    with metrics.span("db." + func.__name__.lstrip("_")):
+        return await loop.run_in_executor(_read_executor, func, *args)
+
+
+def _close():
+    global _conn
+    if _conn is not None:
+        _conn.close()
+        _conn = None
+
+
+async def close():
+    """Записывает отложенные объявления, закрывает соединения с БД и останавливает потоки хранилища."""
+    await flush()
+    if _read_executor is not None:
+        _read_executor.shutdown(wait=True)
+        for conn in _read_conns:
+            conn.close()
+        del _read_conns[:]
+    # Последнее закрываемое соединение переносит WAL в файл БД
+    await _run(_close)
+    _executor.shutdown(wait=True)
+
+
+def check_integrity() -> list:
+    """Проверяет БД при запуске (SQLITE_INTEGRITY_CHECK: "quick", "full" или "off").
+       Возвращает список найденных проблем, пустой — если БД в порядке."""
+    if SQLITE_INTEGRITY_CHECK == "off":
+        return []
+    pragma = "integrity_check" if SQLITE_INTEGRITY_CHECK == "full" else "quick_check"
+    conn = _connect()
+    try:
+        rows = [row[0] for row in conn.execute(f"PRAGMA {pragma}")]
+    finally:
+        conn.close()
+    return [] if rows == ["ok"] else rows
+
+
+def _checkpoint(mode: str):
+    return _get_conn().execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+
+
+async def checkpoint(mode: str = "PASSIVE"):
+    """Переносит WAL в файл БД. PASSIVE не ждёт читающих, TRUNCATE ещё и обрезает файл WAL.
+       Возвращает (1, если помешали читающие, иначе 0; страниц в WAL; перенесено страниц)."""
+    if not WAL_PROFILE:
+        return (0, 0, 0)
+    return await _run(_checkpoint, mode)
+
+
+# --- Объявления ---
+
+def _before_message(before_message_id: int):
+    """Условие и параметры для отбора объявлений из сообщений раньше before_message_id (None — без отбора).
+       ID сообщений в группе возрастают, поэтому порядок верен и для сообщений в одну и ту же секунду;
+       у объявлений, сохранённых до появления колонки message_id, она пустая — они заведомо раньше."""
+    if before_message_id is None:
+        return "", ()
+    return " AND (message_id IS NULL OR message_id < ?)", (before_message_id,)
+
+
+def _is_before(message_id: int, before_message_id: int) -> bool:
+    return before_message_id is None or message_id is None or message_id < before_message_id
+
+
+def _get_ad_record(chat_id: int, user_id: int, photo_id: str, text: str, time_threshold: int,
+                   before_message_id: int):
+    conn = _get_read_conn()
+    result = None
+    before_sql, before_params = _before_message(before_message_id)
+
+    # Если есть фото, ищем по photo_id
+    if photo_id:
+        cursor = conn.execute(
+            "SELECT id, thread_id, timestamp, text FROM ads "
+            "WHERE chat_id=? AND user_id=? AND photo_id=? AND timestamp >= ?" + before_sql,
+            (chat_id, user_id, photo_id, time_threshold, *before_params)
+        )
+        result = cursor.fetchone()  # (id, thread_id, timestamp, text) или None
+
+    # Если есть текст, ищем по хэшу текста (если фото не найдено или его нет);
+    # сравнение текста отсекает совпадения хэшей разных текстов
+    if text and not result:
+        cursor = conn.execute(
+            "SELECT id, thread_id, timestamp, text FROM ads "
+            "WHERE chat_id=? AND user_id=? AND text_hash=? AND timestamp >= ? AND text=?" + before_sql,
+            (chat_id, user_id, hashing.text_hash(text), time_threshold, text, *before_params)
+        )
+        result = cursor.fetchone()  # (id, thread_id, timestamp, text) или None
+
+    return result
+
+
+def _get_photo_record(chat_id: int, user_id: int, photo_ids: list, time_threshold: int, before_message_id: int):
+    placeholders = ", ".join("?" * len(photo_ids))
+    before_sql, before_params = _before_message(before_message_id)
+    cursor = _get_read_conn().execute(
+        "SELECT id, thread_id, timestamp, text, photo_id FROM ads "
+        f"WHERE chat_id=? AND user_id=? AND photo_id IN ({placeholders}) AND timestamp >= ?" + before_sql,
+        (chat_id, user_id, *photo_ids, time_threshold, *before_params)
+    )
+    return cursor.fetchone()  # (id, thread_id, timestamp, text, photo_id) или None
+
+
+def _get_recent_ads(chat_id: int, user_id: int, since: int, before_message_id: int):
+    before_sql, before_params = _before_message(before_message_id)
+    cursor = _get_read_conn().execute(
+        "SELECT text, photo_id, timestamp, thread_id, features FROM ads "
+        "WHERE chat_id=? AND user_id=? AND timestamp >= ?" + before_sql,
+        (chat_id, user_id, since, *before_params)
+    )
+    return cursor.fetchall()  # (text, photo_id, timestamp, thread_id, features)
+
+
+def _get_message_ids(chat_id: int, user_id: int, since: int):
+    cursor = _get_read_conn().execute(
+        "SELECT DISTINCT message_id FROM ads WHERE chat_id=? AND user_id=? AND timestamp >= ? AND message_id IS NOT NULL",
+        (chat_id, user_id, since)
+    )
+    return [row[0] for row in cursor]
+
+
+def _get_ads_since(since: int):
+    cursor = _get_read_conn().execute(
+        "SELECT chat_id, user_id, thread_id, text, timestamp FROM ads WHERE timestamp >= ? AND text != '' ORDER BY timestamp",
+        (since,)
+    )
+    return cursor.fetchall()
+
+
+def _get_photo_hashes_since(since: int):
+    cursor = _get_read_conn().execute(
+        "SELECT chat_id, user_id, thread_id, photo_id, photo_hash, timestamp FROM ads "
+        "WHERE timestamp >= ? AND photo_hash IS NOT NULL ORDER BY timestamp",
+        (since,)
+    )
+    return cursor.fetchall()
+
+
+def _write_ads(rows: list):
+    # Все накопленные объявления — одной транзакцией (один fsync)
+    conn = _get_conn()
+    with conn:
+        conn.executemany(
+            "INSERT INTO ads (chat_id, user_id, thread_id, text, photo_id, timestamp, features, photo_hash, "
+            "text_hash, message_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+
+
+# Отложенная запись объявлений: новые объявления копятся в памяти и записываются
+# пачкой — когда их набирается WRITE_BATCH_SIZE, через WRITE_FLUSH_SECONDS после первой
+# или при остановке бота. Пока запись не завершена, поиск повторов учитывает и эти строки.
+# При аварийной остановке теряются записи не более чем за WRITE_FLUSH_SECONDS.
+WRITE_BATCH_SIZE = 100
+WRITE_FLUSH_SECONDS = 1.0
+
+_pending_writes = []  # строки для вставки в ads
+_flushing_writes = []  # пачка, которая сейчас записывается
+_flush_handle = None
+_flush_lock = None
+_flush_tasks = set()
+
+
+def _buffered_ads():
+    """Незаписанные объявления:
+       (chat_id, user_id, thread_id, text, photo_id, timestamp, features, photo_hash, text_hash, message_id)."""
+    yield from _flushing_writes
+    yield from _pending_writes
+
+
+def _start_flush():
+    task = asyncio.ensure_future(flush())
+    _flush_tasks.add(task)
+    task.add_done_callback(_flush_tasks.discard)
+
+
+def _schedule_flush():
+    global _flush_handle
+    _flush_handle = None
+    _start_flush()
+
+
+async def flush():
+    """Записывает в БД все накопленные объявления."""
+    global _flush_handle, _flushing_writes, _flush_lock
+    if _flush_lock is None:
+        _flush_lock = asyncio.Lock()
+    async with _flush_lock:
+        if _flush_handle is not None:
+            _flush_handle.cancel()
+            _flush_handle = None
+        if not _pending_writes:
+            return
+        _flushing_writes = _pending_writes[:]
+        del _pending_writes[:]
+        try:
+            await _run(_write_ads, _flushing_writes)
+        except Exception as e:
+            logger.error("Ошибка записи объявлений в БД: %s", e)
+            # Возвращаем пачку в очередь, чтобы повторить запись при следующем сбросе
+            _pending_writes[:0] = _flushing_writes
+        finally:
+            _flushing_writes = []
+
+
+def _buffer_write(row: tuple):
+    global _flush_handle
+    _pending_writes.append(row)
+    if len(_pending_writes) >= WRITE_BATCH_SIZE:
+        _start_flush()
+    elif _flush_handle is None:
+        _flush_handle = asyncio.get_running_loop().call_later(WRITE_FLUSH_SECONDS, _schedule_flush)
+
+
+async def get_ad_record(chat_id: int, user_id: int, photo_id: str, text: str, thread_id: int,
+                        before_message_id: int = None):
+    """Объявление пользователя в группе с тем же фото или текстом за период темы:
+       (id, thread_id, timestamp, text) или None. Для ещё не записанного в БД объявления id равен None.
+       before_message_id — учитываются только объявления из более ранних сообщений (для отложенных проверок)."""
+    if text and not photo_id and not _might_have_text(chat_id, user_id, text):
+        # Фильтр Блума: такого текста у пользователя точно нет, запрос к БД не нужен
+        metrics.inc("bloom.skip")
+        return None
+    topic_settings = get_topic_settings(chat_id, thread_id)
+    time_threshold = int(time.time()) - topic_settings["ad_frequency_days"] * 24 * 60 * 60
+    # Снимок буфера — до запроса: пачка, записанная во время запроса, попадёт хотя бы в одно из двух
+    buffered = list(_buffered_ads())
+    result = await _read(_get_ad_record, chat_id, user_id, photo_id, text, time_threshold, before_message_id)
+    if result:
+        return result
+    for ad_chat_id, ad_user_id, ad_thread_id, ad_text, ad_photo_id, timestamp, _, _, _, message_id in buffered:
+        if (ad_chat_id != chat_id or ad_user_id != user_id or timestamp < time_threshold
+                or not _is_before(message_id, before_message_id)):
+            continue
+        if (photo_id and ad_photo_id == photo_id) or (text and ad_text == text):
+            return (None, ad_thread_id, timestamp, ad_text)
+    return None
+
+
+async def get_photo_record(chat_id: int, user_id: int, photo_ids: list, thread_id: int,
+                           before_message_id: int = None):
+    """Объявление пользователя в группе с любым из фото photo_ids за период темы:
+       (id, thread_id, timestamp, text, photo_id) или None. Один запрос на все фото альбома.
+       before_message_id — как в get_ad_record."""
+    topic_settings = get_topic_settings(chat_id, thread_id)
+    time_threshold = int(time.time()) - topic_settings["ad_frequency_days"] * 24 * 60 * 60
+    buffered = list(_buffered_ads())
+    result = await _read(_get_photo_record, chat_id, user_id, list(photo_ids), time_threshold, before_message_id)
+    if result:
+        return result
+    for ad_chat_id, ad_user_id, ad_thread_id, ad_text, ad_photo_id, timestamp, _, _, _, message_id in buffered:
+        if (ad_chat_id == chat_id and ad_user_id == user_id and timestamp >= time_threshold
+                and ad_photo_id in photo_ids and _is_before(message_id, before_message_id)):
+            return (None, ad_thread_id, timestamp, ad_text, ad_photo_id)
+    return None
+
+
+async def get_recent_ads(chat_id: int, user_id: int, since: int, before_message_id: int = None):
+    """Все объявления пользователя в группе, начиная с момента since; before_message_id — как в get_ad_record."""
+    buffered = list(_buffered_ads())
+    rows = await _read(_get_recent_ads, chat_id, user_id, since, before_message_id)
+    for ad_chat_id, ad_user_id, thread_id, text, photo_id, timestamp, features, _, _, message_id in buffered:
+        if (ad_chat_id == chat_id and ad_user_id == user_id and timestamp >= since
+                and _is_before(message_id, before_message_id)):
+            rows.append((text, photo_id, timestamp, thread_id, features))
+    return rows
+
+
+async def get_message_ids(chat_id: int, user_id: int, since: int) -> list:
+    """ID сообщений с объявлениями пользователя в группе начиная с since, по возрастанию."""
+    buffered = list(_buffered_ads())
+    message_ids = set(await _read(_get_message_ids, chat_id, user_id, since))
+    for ad_chat_id, ad_user_id, _, _, _, timestamp, _, _, _, message_id in buffered:
+        if ad_chat_id == chat_id and ad_user_id == user_id and timestamp >= since and message_id is not None:
+            message_ids.add(message_id)
+    return sorted(message_ids)
+
+
+async def get_ads_since(since: int):
+    """Текстовые объявления всех групп начиная с since: (chat_id, user_id, thread_id, text, timestamp)."""
+    await flush()
+    return await _read(_get_ads_since, since)
+
+
+async def get_photo_hashes_since(since: int):
+    """Отпечатки фото всех групп начиная с since: (chat_id, user_id, thread_id, photo_id, photo_hash, timestamp)."""
+    await flush()
+    return await _read(_get_photo_hashes_since, since)
+
+
+async def insert_ad_record(chat_id: int, user_id: int, thread_id: int, text: str, photo_id: str,
+                           features: bytes = None, photo_hash: int = None, timestamp: int = None,
+                           message_id: int = None):
+    """Сохраняет объявление (с отложенной записью, см. flush). features — вектор текста
+       (similarity.vectorize), посчитанный один раз при проверке сообщения, чтобы при следующих
+       проверках текст не векторизовался заново. photo_hash — перцептивный хэш фото (photos.dhash)
+       в виде для БД (photos.to_db). timestamp — время объявления, по умолчанию текущее.
+       message_id — ID сообщения в группе (для удаления при блокировке)."""
+    text_hash = hashing.text_hash(text) if text else None
+    if text_hash is not None:
+        _remember_text(chat_id, user_id, text_hash)
+    _buffer_write(
+        (chat_id, user_id, thread_id, text, photo_id, timestamp or int(time.time()), features, photo_hash,
+         text_hash, message_id)
+    )
+
+
+def _set_ad_fingerprints(chat_id: int, user_id: int, rows: list):
+    conn = _get_conn()
+    with conn:
+        conn.executemany(
+            "UPDATE ads SET features = COALESCE(?, features), photo_hash = COALESCE(?, photo_hash) "
+            "WHERE chat_id=? AND user_id=? AND message_id=?",
+            [(features, photo_hash, chat_id, user_id, message_id) for message_id, features, photo_hash in rows]
+        )
+
+
+async def set_ad_fingerprints(chat_id: int, user_id: int, rows: list):
+    """Дописывает к сохранённым объявлениям вектор текста и хэши фото, посчитанные при отложенной
+       проверке. rows — (message_id, features, photo_hash); None оставляет прежнее значение."""
+    # Строки могут ещё быть в буфере записи
+    await flush()
+    await _run(_set_ad_fingerprints, chat_id, user_id, rows)
+
+
+# --- Фильтр Блума текстов ---
+# Для каждого пользователя группы — фильтр Блума хэшей текстов его объявлений за период
+# проверки. Если текста в фильтре нет, точного повтора нет, и get_ad_record не обращается к БД.
+# Из фильтра нельзя удалять, поэтому он перестраивается при очистке БД (load_text_filters);
+# устаревшие хэши до перестройки дают лишь лишний запрос. Пока фильтры не загружены при запуске,
+# проверка всегда идёт в БД.
+
+_text_filters = {}  # (chat_id, user_id) -> hashing.BloomFilter
+_text_filters_ready = False
+_text_filters_added = None  # хэши, добавленные во время перестройки фильтров
+
+
+def _get_text_hashes_since(since: int):
+    cursor = _get_read_conn().execute(
+        "SELECT chat_id, user_id, text_hash FROM ads WHERE timestamp >= ? AND text_hash IS NOT NULL", (since,)
+    )
+    return cursor.fetchall()
+
+
+def _add_to_filters(filters: dict, chat_id: int, user_id: int, text_hash: int):
+    text_filter = filters.get((chat_id, user_id))
+    if text_filter is None:
+        text_filter = filters[(chat_id, user_id)] = hashing.BloomFilter()
+    text_filter.add(text_hash)
+
+
+def _remember_text(chat_id: int, user_id: int, text_hash: int):
+    _add_to_filters(_text_filters, chat_id, user_id, text_hash)
+    if _text_filters_added is not None:
+        _text_filters_added.append((chat_id, user_id, text_hash))
+
+
+def _might_have_text(chat_id: int, user_id: int, text: str) -> bool:
+    if not _text_filters_ready:
+        return True
+    text_filter = _text_filters.get((chat_id, user_id))
+    return text_filter is not None and hashing.text_hash(text) in text_filter
+
+
+async def load_text_filters(since: int):
+    """Строит фильтры заново по объявлениям начиная с since и включает проверку по ним."""
+    global _text_filters, _text_filters_ready, _text_filters_added
+    _text_filters_added = []
+    try:
+        await flush()
+        rows = await _read(_get_text_hashes_since, since)
+        filters = {}
+        for chat_id, user_id, text_hash in rows + _text_filters_added:
+            _add_to_filters(filters, chat_id, user_id, text_hash)
+        _text_filters = filters
+        _text_filters_ready = True
+    finally:
+        _text_filters_added = None
+
+
+# --- Предупреждения ---
+
+# Счётчик предупреждений увеличивается одним UPSERT по ключу UNIQUE (chat_id, user_id, ad_key);
+# новое значение возвращает RETURNING (SQLite 3.35+), в более старых версиях — отдельный SELECT
+# в той же транзакции.
+_UPSERT_WARNING = (
+    "INSERT INTO warnings (chat_id, user_id, ad_key, warning_count, last_warning) VALUES (?, ?, ?, 1, ?) "
+    "ON CONFLICT (chat_id, user_id, ad_key) DO UPDATE SET "
+    "warning_count = warning_count + 1, last_warning = excluded.last_warning"
+)
+_RETURNING_SUPPORTED = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+
+def _record_violation(chat_id: int, user_id: int, first_name: str, ad_key: str, warnings_limit: int,
+                      banned_until: int, reason: str) -> int:
+    conn = _get_conn()
+    params = (chat_id, user_id, ad_key, int(time.time()))
+    with conn:
+        if _RETURNING_SUPPORTED:
+            warning_count = conn.execute(_UPSERT_WARNING + " RETURNING warning_count", params).fetchone()[0]
+        else:
+            conn.execute(_UPSERT_WARNING, params)
+            warning_count = conn.execute(
+                "SELECT warning_count FROM warnings WHERE chat_id=? AND user_id=? AND ad_key=?", params[:3]
+            ).fetchone()[0]
+        if warning_count >= warnings_limit:
+            conn.execute(
+                "INSERT INTO bans (chat_id, user_id, first_name, banned_until, reason) VALUES (?, ?, ?, ?, ?)",
+                (chat_id, user_id, first_name, banned_until, reason)
+            )
+            conn.execute("DELETE FROM warnings WHERE chat_id=? AND user_id=? AND ad_key=?", params[:3])
+    return warning_count
+
+
+async def record_violation(chat_id: int, user_id: int, first_name: str, ad_key: str, warnings_limit: int,
+                           banned_until: int, reason: str) -> int:
+    """Учитывает нарушение одной транзакцией: увеличивает счётчик предупреждений за объявление ad_key,
+       а если он достиг warnings_limit — сохраняет блокировку до banned_until (0 — навсегда)
+       и сбрасывает счётчик. Возвращает новое число предупреждений (до сброса)."""
+    return await _run(_record_violation, chat_id, user_id, first_name, ad_key, warnings_limit, banned_until, reason)
+
+
+# --- Темы ---
+
+def _row_to_settings(row) -> dict:
+    return {
+        "enabled": bool(row[1]),
+        "block_days": row[2],
+        "warnings_limit": row[3],
+        "ad_frequency_days": row[4],
+        "cross_user_action": row[5] or DEFAULT_TOPIC_SETTINGS["cross_user_action"]
+    }
+
+
+def _ensure_topic_exists(chat_id: int, thread_id: int):
+    conn = _get_conn()
+    cursor = conn.execute("SELECT thread_id FROM topics WHERE chat_id=? AND thread_id=?", (chat_id, thread_id))
+    if not cursor.fetchone():
+        conn.execute(
+            "INSERT INTO topics (chat_id, thread_id, enabled, block_days, warnings_limit) VALUES (?, ?, ?, ?, ?)",
+            (chat_id, thread_id, 1, 5, 3)
+        )
+        conn.commit()
+    cursor = conn.execute(
+        "SELECT thread_id, enabled, block_days, warnings_limit, ad_frequency_days, cross_user_action FROM topics "
+        "WHERE chat_id=? AND thread_id=?",
+        (chat_id, thread_id)
+    )
+    return cursor.fetchone()
+
+
+def _get_topics(chat_id: int):
+    cursor = _get_read_conn().execute(
+        "SELECT thread_id, enabled, block_days, warnings_limit, ad_frequency_days, cross_user_action FROM topics "
+        "WHERE chat_id=?",
+        (chat_id,)
+    )
+    return cursor.fetchall()
+
+
+def _get_topic_status(chat_id: int, topic_id: int):
+    cursor = _get_read_conn().execute("SELECT enabled FROM topics WHERE chat_id=? AND thread_id=?", (chat_id, topic_id))
+    result = cursor.fetchone()
+    return result[0] if result else None
+
+
+def _toggle_topic_status(chat_id: int, topic_id: int):
+    conn = _get_conn()
+    row = conn.execute("SELECT enabled FROM topics WHERE chat_id=? AND thread_id=?", (chat_id, topic_id)).fetchone()
+    current_status = row[0] if row else None
+    if current_status is None:
+        return None
+    new_status = 0 if current_status else 1
+    conn.execute("UPDATE topics SET enabled=? WHERE chat_id=? AND thread_id=?", (new_status, chat_id, topic_id))
+    conn.commit()
+    return new_status
+
+
+def _update_topic_field(chat_id: int, topic_id: int, field: str, value) -> bool:
+    conn = _get_conn()
+    cursor = conn.execute(f"UPDATE topics SET {field}=? WHERE chat_id=? AND thread_id=?", (value, chat_id, topic_id))
+    conn.commit()
+    return cursor.rowcount > 0
+
+
+def _max_ad_frequency_days():
+    return _get_read_conn().execute("SELECT MAX(ad_frequency_days) FROM topics").fetchone()[0]
+
+
+def _cache_topic_field(chat_id: int, topic_id: int, field: str, value):
+    topics = _topics.get(chat_id)
+    if topics is None:
+        # Группа ещё не загружена в кэш — изменение будет прочитано из БД при загрузке
+        return
+    settings = dict(topics.get(topic_id, DEFAULT_TOPIC_SETTINGS))
+    settings[field] = value
+    topics[topic_id] = settings
+
+
+async def load_topics(chat_id: int) -> dict:
+    """Загружает настройки всех тем группы в кэш, если они ещё не загружены. Возвращает {thread_id: настройки}."""
+    topics = _topics.get(chat_id)
+    if topics is None:
+        rows = await _read(_get_topics, chat_id)
+        # Пока шёл запрос, группу мог загрузить другой обработчик
+        topics = _topics.setdefault(chat_id, {row[0]: _row_to_settings(row) for row in rows})
+    return topics
+
+
+def get_topic_settings(chat_id: int, thread_id: int) -> dict:
+    """Настройки темы из кэша (без обращения к БД). Для неизвестной темы — значения по умолчанию."""
+    settings = _topics.get(chat_id, {}).get(thread_id)
+    if settings is None:
+        return dict(DEFAULT_TOPIC_SETTINGS)
+    return settings
+
+
+async def ensure_topic_exists(chat_id: int, thread_id: int):
+    topics = await load_topics(chat_id)
+    if thread_id in topics:
+        metrics.inc("topic_cache.hit")
+        return
+    metrics.inc("topic_cache.miss")
+    row = await _run(_ensure_topic_exists, chat_id, thread_id)
+    topics[thread_id] = _row_to_settings(row)
+
+
+async def get_topics(chat_id: int):
+    """Список тем группы: (thread_id, enabled, block_days, warnings_limit, ad_frequency_days, cross_user_action)."""
+    return await _read(_get_topics, chat_id)
+
+
+async def get_topic_status(chat_id: int, topic_id: int):
+    """Возвращает статус темы: 1 — включена, 0 — выключена, None — тема не найдена."""
+    return await _read(_get_topic_status, chat_id, topic_id)
+
+
+async def toggle_topic_status(chat_id: int, topic_id: int):
+    """Переключает статус темы: если включена – выключает, если выключена – включает.
+       Возвращает новый статус или None, если тема не найдена."""
+    new_status = await _run(_toggle_topic_status, chat_id, topic_id)
+    if new_status is not None:
+        _cache_topic_field(chat_id, topic_id, "enabled", bool(new_status))
+    return new_status
+
+
+async def _update_topic(chat_id: int, topic_id: int, field: str, value) -> bool:
+    success = await _run(_update_topic_field, chat_id, topic_id, field, value)
+    if success:
+        _cache_topic_field(chat_id, topic_id, field, value)
+    return success
+
+
+async def update_topic_block_days(chat_id: int, topic_id: int, days: int) -> bool:
+    """Обновляет время блокировки (block_days) для заданной темы.
+       Возвращает True при успехе, False если тема не найдена."""
+    return await _update_topic(chat_id, topic_id, "block_days", days)
+
+
+async def update_topic_warnings_limit(chat_id: int, topic_id: int, warnings_limit: int) -> bool:
+    """Обновляет количество предупреждений до блокировки (warnings_limit) для заданной темы.
+       Возвращает True при успехе, False если тема не найдена."""
+    return await _update_topic(chat_id, topic_id, "warnings_limit", warnings_limit)
+
+
+async def update_topic_ad_frequency(chat_id: int, topic_id: int, days: int) -> bool:
+    """Обновляет периодичность рекламы (ad_frequency_days) для заданной темы.
+       Возвращает True при успехе, False если тема не найдена."""
+    return await _update_topic(chat_id, topic_id, "ad_frequency_days", days)
+
+
+async def update_topic_cross_user_action(chat_id: int, topic_id: int, action: str) -> bool:
+    """Обновляет действие при совпадении с объявлением другого пользователя (cross_user_action).
+       Возвращает True при успехе, False если тема не найдена."""
+    return await _update_topic(chat_id, topic_id, "cross_user_action", action)
+
+
+# --- Блокировки ---
+
+def _add_ban(chat_id: int, user_id: int, first_name: str, banned_until: int, reason: str):
+    conn = _get_conn()
+    conn.execute(
+        "INSERT INTO bans (chat_id, user_id, first_name, banned_until, reason) VALUES (?, ?, ?, ?, ?)",
+        (chat_id, user_id, first_name, banned_until, reason)
+    )
+    conn.commit()
+
+
+def _remove_ban(chat_id: int, user_id: int):
+    conn = _get_conn()
+    conn.execute("DELETE FROM bans WHERE chat_id=? AND user_id=?", (chat_id, user_id))
+    conn.commit()
+
+
+def _remove_expired_bans(now: int) -> int:
+    conn = _get_conn()
+    with conn:
+        return conn.execute("DELETE FROM bans WHERE banned_until != 0 AND banned_until <= ?", (now,)).rowcount
+
+
+def _get_banned_users(chat_id: int):
+    cursor = _get_read_conn().execute(
+        "SELECT user_id, first_name, banned_until, reason FROM bans "
+        "WHERE chat_id=? AND (banned_until > ? OR banned_until = 0)",
+        (chat_id, int(time.time()))
+    )
+    return cursor.fetchall()
+
+
+def _get_all_bans():
+    cursor = _get_read_conn().execute("SELECT chat_id, user_id, first_name, banned_until FROM bans ORDER BY id")
+    return cursor.fetchall()
+
+
+async def get_all_bans():
+    """Все записи о блокировках во всех группах в порядке добавления: (chat_id, user_id, first_name, banned_until)."""
+    return await _read(_get_all_bans)
+
+
+async def add_ban(chat_id: int, user_id: int, first_name: str, banned_until: int, reason: str):
+    await _run(_add_ban, chat_id, user_id, first_name, banned_until, reason)
+
+
+async def remove_ban(chat_id: int, user_id: int):
+    await _run(_remove_ban, chat_id, user_id)
+
+
+async def remove_expired_bans(now: int) -> int:
+    """Удаляет временные блокировки во всех группах, истёкшие к моменту now; возвращает их число."""
+    return await _run(_remove_expired_bans, now)
+
+
+async def get_banned_users(chat_id: int):
+    return await _read(_get_banned_users, chat_id)
+
+
+# --- Очистка устаревших данных ---
+
+def _prune(ads_before: int, warnings_before: int, now: int) -> dict:
+    conn = _get_conn()
+    with conn:
+        ads = conn.execute("DELETE FROM ads WHERE timestamp < ?", (ads_before,)).rowcount
+        warnings = conn.execute("DELETE FROM warnings WHERE last_warning < ?", (warnings_before,)).rowcount
+        bans = conn.execute("DELETE FROM bans WHERE banned_until != 0 AND banned_until < ?", (now,)).rowcount
+    return {"ads": ads, "warnings": warnings, "bans": bans}
+
+
+def _database_size() -> int:
+    conn = _get_conn()
+    page_count = conn.execute("PRAGMA page_count").fetchone()[0]
+    page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    return page_count * page_size
+
+
+ANALYSIS_LIMIT = 1000  # сколько строк каждого индекса просматривает ANALYZE
+
+
+def _vacuum() -> int:
+    conn = _get_conn()
+    size_before = _database_size()
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        # Каждый шаг команды освобождает одну страницу, а execute делает только первый шаг;
+        # executescript выполняет команду до конца
+        conn.executescript("PRAGMA incremental_vacuum;")
+    else:
+        # Полная перестройка файла заблокировала бы запись на всё время работы, поэтому
+        # режим включается вручную при остановленном боте (sql.enable_incremental_vacuum)
+        logger.warning("Место после очистки не возвращается файлу БД: выполните python sql.py vacuum при остановленном боте")
+    # Полный ANALYZE читает все строки и на большой БД надолго занял бы поток записи;
+    # для выбора индексов хватает выборки (analysis_limit, SQLite 3.32+)
+    conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    conn.execute("ANALYZE")
+    return size_before - _database_size()
+
+
+async def prune(ads_before: int, warnings_before: int) -> dict:
+    """Удаляет объявления старше ads_before, предупреждения без новых нарушений с warnings_before
+       и истёкшие блокировки. Возвращает число удалённых строк по таблицам."""
+    await flush()
+    return await _run(_prune, ads_before, warnings_before, int(time.time()))
+
+
+async def vacuum() -> int:
+    """Возвращает освободившееся место файлу БД и обновляет статистику для планировщика запросов.
+       Возвращает число освобождённых байт."""
+    return await _run(_vacuum)
+
+
+async def max_ad_frequency_days() -> int:
+    """Наибольший период проверки повторов среди тем всех групп."""
+    days = await _read(_max_ad_frequency_days)
+    return max(days or 0, DEFAULT_TOPIC_SETTINGS["ad_frequency_days"])
@@ -0,0 +1,101 @@
+import asyncio
+import hmac
+import logging
+import secrets
+import signal
+import time
+from aiohttp import web
+from aiogram import types
+from config import WEBHOOK_URL, WEBHOOK_SECRET, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, UPDATE_QUEUE_SIZE, UPDATE_WORKERS
+from app import metrics
+
+logger = logging.getLogger(__name__)
+
+# Приём обновлений через вебхук вместо long polling. HTTP-обработчик только проверяет
+# секрет и кладёт обновление в ограниченную очередь, а обрабатывают его UPDATE_WORKERS
+# обработчиков — приём не ждёт, пока идёт модерация. Если очередь заполнена, Telegram
+# получает 503 и доставит обновление повторно.
+SHUTDOWN_TIMEOUT = 10  # сколько при остановке ждать обработки уже принятых обновлений, сек.
+
+
+async def serve(dp, bot):
+    """Устанавливает вебхук и принимает обновления до SIGINT/SIGTERM."""
+    queue = asyncio.Queue(maxsize=UPDATE_QUEUE_SIZE)
+    stopping = asyncio.Event()
+    # Без секрета любой, кто узнал адрес, мог бы присылать поддельные обновления (в том числе
+    # команды от имени администраторов), поэтому при пустом WEBHOOK_SECRET он создаётся при запуске
+    secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+
+    async def worker():
+        while True:
+            update, received = await queue.get()
+            metrics.observe("update.wait", time.monotonic() - received)
+            try:
+                await dp.feed_update(bot, update)
+            except Exception as e:
+                logger.exception("Ошибка при обработке обновления %s: %s", update.update_id, e)
+            finally:
+                queue.task_done()
+
+    async def handle_update(request: web.Request):
+        # Сравниваются байты: для строк с не-ASCII символами compare_digest бросает TypeError
+        if not hmac.compare_digest(request.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode(), secret.encode()):
+            return web.Response(status=401)
+        if stopping.is_set():
+            return web.Response(status=503)
+        try:
+            update = types.Update.model_validate(await request.json(), context={"bot": bot})
+        except Exception as e:
+            logger.warning("Некорректное обновление от Telegram: %s", e)
+            return web.Response(status=400)
+        try:
+            queue.put_nowait((update, time.monotonic()))
+        except asyncio.QueueFull:
+            metrics.inc("updates.rejected")
+            return web.Response(status=503)
+        metrics.inc("updates")
+        return web.Response()
+
+    async def handle_health(request: web.Request):
+        return web.json_response({
+            "status": "stopping" if stopping.is_set() else "ok",
+            "queue": queue.qsize(),
+            "queue_size": UPDATE_QUEUE_SIZE,
+            "workers": UPDATE_WORKERS,
+        })
+
+    app = web.Application()
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.router.add_get("/health", handle_health)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT)
+    await site.start()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+
+    tasks = [asyncio.create_task(worker()) for _ in range(UPDATE_WORKERS)]
+    try:
+        await bot.set_webhook(
+            WEBHOOK_URL,
+            secret_token=secret,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logger.info("Вебхук установлен, приём обновлений на %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+        await stopping.wait()
+    finally:
+        # Новые обновления не принимаются, уже принятые обрабатываются до конца.
+        # Вебхук не удаляется: Telegram придержит обновления до следующего запуска.
+        stopping.set()
+        await site.stop()
+        try:
+            await asyncio.wait_for(queue.join(), SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning("Не обработано обновлений при остановке: %s", queue.qsize())
+        for task in tasks:
+            task.cancel()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        await runner.cleanup()
@@ -0,0 +1,52 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from config import CHECK_EXECUTOR, CHECK_WORKERS, CHECK_QUEUE_SIZE, CHECK_TIMEOUT
+
+# Пул для тяжёлых проверок (векторизация и схожесть текстов, хэши фото), чтобы они
+# не занимали цикл событий. Очередь ограничена: одновременно в работе и в ожидании
+# не больше CHECK_QUEUE_SIZE проверок, остальные ждут свободного места.
+# В пул передаются только функции уровня модуля с простыми аргументами — они должны сериализоваться.
+_executor = None
+_slots = None
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        if CHECK_EXECUTOR == "thread":
+            _executor = ThreadPoolExecutor(max_workers=CHECK_WORKERS, thread_name_prefix="checks")
+        else:
+            # Пул создаётся, когда в процессе уже работают потоки (БД, журнал); fork копирует их
+            # блокировки в захваченном состоянии, и процесс пула может зависнуть, поэтому spawn
+            _executor = ProcessPoolExecutor(max_workers=CHECK_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+async def _submit(func, *args):
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(CHECK_QUEUE_SIZE)
+    async with _slots:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), func, *args)
+
+
+async def run(func, *args):
+    """Выполняет func(*args) в пуле проверок и возвращает результат.
+       Бросает asyncio.TimeoutError, если проверка вместе с ожиданием в очереди
+       заняла больше CHECK_TIMEOUT секунд."""
+    return await asyncio.wait_for(_submit(func, *args), CHECK_TIMEOUT)
+
+
+async def warmup(func):
+    """Выполняет func один раз в каждом процессе пула (например, загрузку библиотек),
+       чтобы первые проверки после запуска не ждали импорта."""
+    await asyncio.gather(*(run(func) for _ in range(CHECK_WORKERS)), return_exceptions=True)
+
+
+def shutdown():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
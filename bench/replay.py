@@ -0,0 +1,416 @@
+"""Бенчмарк модерации: прогоняет синтетический трафик через app.handlers.handle_group_message
+и команды администратора с подменённым Bot (запросы к Telegram не уходят) и временной БД.
+
+Запуск из корня репозитория:
+    python bench/replay.py                      # все сценарии
+    python bench/replay.py spam_wave photo_flood
+    python bench/replay.py --workers 4 --output results.json
+
+Каждый сценарий выполняется в отдельном процессе с чистым состоянием. Для каждого выводятся
+p50/p95/p99 задержки обработки сообщения, сообщений в секунду, запросов к БД на сообщение
+и пиковая память; результаты записываются в JSON (по умолчанию bench/results/<коммит>.json),
+чтобы сравнивать их между коммитами.
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import types as pytypes
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+GROUP_ID = -1001234567890
+ADMIN_ID = 1000
+
+WORDS = (
+    "продаю продам куплю сдаю сниму дом дача участок сотки баня гараж квартира комната машина "
+    "недорого срочно торг звоните пишите цена рублей новый б/у состояние отличное доставка "
+    "самовывоз рядом остановка магазин школа лес озеро газ свет вода забор теплица навоз дрова "
+    "щебень песок услуги ремонт электрик сантехник покос травы уборка снега вывоз мусора"
+).split()
+
+
+# --- Подмена окружения бота ---
+
+def install_config(db_path: str, args, groups: list = ()):
+    """Вместо config.py (там токен и путь к рабочей БД) подставляет настройки бенчмарка."""
+    from aiogram import Bot
+
+    class FakeBot(Bot):
+        """Bot, который не ходит в Telegram: запоминает запросы и отвечает с задержкой api_latency."""
+
+        def __init__(self):
+            super().__init__("123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA")
+            self.requests = {}
+
+        async def __call__(self, method, request_timeout=None):
+            name = type(method).__name__
+            self.requests[name] = self.requests.get(name, 0) + 1
+            if args.api_latency:
+                await asyncio.sleep(args.api_latency)
+            if name == "GetChatMember":
+                from aiogram import types
+                return types.ChatMemberMember(user=types.User(id=method.user_id, is_bot=False, first_name="User"))
+            return True
+
+    config = pytypes.ModuleType("config")
+    config.BOT_TOKEN = "123456789:AAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAAA"
+    config.bot = FakeBot()
+    config.DB_PATH = db_path
+    config.ADMIN_IDS = [str(ADMIN_ID)]
+    config.GROUP_ID = GROUP_ID
+    config.GROUPS = {chat_id: [] for chat_id in groups}
+    config.CHECK_EXECUTOR = args.executor
+    config.CHECK_WORKERS = args.workers
+    config.CHECK_QUEUE_SIZE = 1000
+    config.CHECK_TIMEOUT = 60
+    config.RESTORE_PERMISSIONS_ON_BAN_EXPIRY = True
+    config.SQLITE_PROFILE = args.sqlite_profile
+    config.SQLITE_READERS = 4
+    config.SQLITE_MMAP_SIZE_MB = 256
+    config.SQLITE_CACHE_SIZE_MB = 64
+    config.SQLITE_CHECKPOINT_SECONDS = 60
+    config.SQLITE_INTEGRITY_CHECK = "off"
+    config.LOAD_EXACT_BACKLOG = 50
+    config.LOAD_EXACT_DELAY = 10
+    config.LOAD_FLOOD_BACKLOG = 200
+    config.LOAD_FLOOD_DELAY = 30
+    config.FLOOD_LIMIT = 5
+    config.FLOOD_WINDOW_SECONDS = 60
+    config.PURGE_ON_BAN_HOURS = 24
+    sys.modules["config"] = config
+    return config
+
+
+def make_message(bot, message_id: int, user_id: int, thread_id: int, text: str = None, photo: str = None,
+                 chat_id: int = GROUP_ID, chat_type: str = "supergroup"):
+    from aiogram import types
+    photo_sizes = None
+    if photo:
+        photo_sizes = [
+            types.PhotoSize(file_id=f"small-{photo}-{message_id}", file_unique_id=photo, width=90, height=90),
+            types.PhotoSize(file_id=f"big-{photo}-{message_id}", file_unique_id=photo, width=800, height=800),
+        ]
+    return types.Message(
+        message_id=message_id,
+        date=datetime.datetime.now(),
+        chat=types.Chat(id=chat_id, type=chat_type),
+        from_user=types.User(id=user_id, is_bot=False, first_name=f"User{user_id}"),
+        message_thread_id=thread_id or None,
+        text=text if not photo else None,
+        caption=text if photo else None,
+        photo=photo_sizes,
+    ).as_(bot)
+
+
+# --- Сценарии ---
+# Сценарий возвращает словарь: messages — список (user_id, thread_id, text, photo),
+# concurrency — сколько сообщений обрабатывается одновременно, seed_ads — сколько старых
+# объявлений положить в БД заранее, admin — прогнать команды администратора,
+# chats — группы сообщений (по умолчанию все сообщения приходят в GROUP_ID).
+
+def random_ad(rng: random.Random, words: int = None) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words or rng.randint(8, 40))) + f" 8{rng.randint(10 ** 9, 10 ** 10 - 1)}"
+
+
+def edit_ad(rng: random.Random, text: str) -> str:
+    words = text.split()
+    for _ in range(max(1, len(words) // 10)):
+        words[rng.randrange(len(words))] = rng.choice(WORDS)
+    return " ".join(words)
+
+
+def scenario_many_users(rng, size):
+    messages = [(rng.randint(1, 1000), rng.choice([0, 2, 3, 5]), random_ad(rng), None) for _ in range(size)]
+    return {"messages": messages, "concurrency": 1}
+
+
+def scenario_heavy_poster(rng, size):
+    ads = [random_ad(rng) for _ in range(20)]
+    messages = []
+    for _ in range(size):
+        text = edit_ad(rng, rng.choice(ads)) if rng.random() < 0.3 else random_ad(rng)
+        messages.append((42, rng.choice([2, 3]), text, None))
+    return {"messages": messages, "concurrency": 1}
+
+
+def scenario_spam_wave(rng, size):
+    base = random_ad(rng, 30)
+    messages = [(5000 + rng.randint(0, 49), rng.choice([0, 2, 3]), edit_ad(rng, base), None) for _ in range(size)]
+    return {"messages": messages, "concurrency": 20}
+
+
+def scenario_photo_flood(rng, size):
+    photos = [f"photo{i}" for i in range(size // 3)]
+    messages = [(rng.randint(1, 50), 5, random_ad(rng, 6) if rng.random() < 0.5 else "", rng.choice(photos))
+                for _ in range(size)]
+    return {"messages": messages, "concurrency": 5, "photos": photos}
+
+
+def scenario_large_history(rng, size):
+    messages = [(rng.randint(1, 2000), rng.choice([0, 2, 3]), random_ad(rng), None) for _ in range(size)]
+    return {"messages": messages, "concurrency": 1, "seed_ads": 200000}
+
+
+def scenario_many_groups(rng, size):
+    groups = [GROUP_ID - i for i in range(200)]
+    messages = [(rng.randint(1, 3000), rng.choice([0, 2, 3]), random_ad(rng), None) for _ in range(size)]
+    return {"messages": messages, "concurrency": 5, "chats": [rng.choice(groups) for _ in messages], "groups": groups}
+
+
+def scenario_admin(rng, size):
+    return {"messages": [], "concurrency": 1, "admin": size}
+
+
+SCENARIOS = {
+    "many_users": scenario_many_users,
+    "heavy_poster": scenario_heavy_poster,
+    "spam_wave": scenario_spam_wave,
+    "photo_flood": scenario_photo_flood,
+    "large_history": scenario_large_history,
+    "many_groups": scenario_many_groups,
+    "admin": scenario_admin,
+}
+
+
+def seed_ads(db_path: str, rng: random.Random, count: int):
+    conn = sqlite3.connect(db_path)
+    now = int(time.time())
+    rows = (
+        (rng.randint(1, 20000), rng.choice([0, 2, 3, 5]), random_ad(rng), "", now - rng.randint(0, 30 * 24 * 3600))
+        for _ in range(count)
+    )
+    conn.executemany("INSERT INTO ads (user_id, thread_id, text, photo_id, timestamp) VALUES (?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def write_photos(directory: str, names: list, rng: random.Random):
+    try:
+        from PIL import Image, ImageDraw
+    except ImportError:
+        return False
+    for name in names:
+        image = Image.new("RGB", (90, 90), "white")
+        draw = ImageDraw.Draw(image)
+        for _ in range(8):
+            x, y = rng.randint(0, 80), rng.randint(0, 80)
+            draw.rectangle([x, y, x + rng.randint(5, 40), y + rng.randint(5, 40)],
+                           fill=tuple(rng.randint(0, 255) for _ in range(3)))
+        image.save(os.path.join(directory, f"{name}.jpg"))
+    return True
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+async def run_scenario(name: str, args) -> dict:
+    # Временная папка с БД и фото удаляется после сценария
+    with tempfile.TemporaryDirectory(prefix="bench-") as workdir:
+        return await _run_scenario(name, args, workdir)
+
+
+async def _run_scenario(name: str, args, workdir: str) -> dict:
+    rng = random.Random(args.seed)
+    spec = SCENARIOS[name](rng, args.size)
+    db_path = os.path.join(workdir, "bench.db")
+    config = install_config(db_path, args, spec.get("groups", ()))
+    sys.path.insert(0, ROOT)
+
+    import sql
+    from app import handlers, storage, similarity, near_duplicates, photos, workers, outbox, metrics
+
+    # Лимиты Telegram в бенчмарке не нужны: измеряется работа самого бота
+    outbox.GLOBAL_RATE = outbox.PRIVATE_CHAT_RATE = outbox.GROUP_CHAT_RATE = 1e9
+    outbox._global_bucket = outbox.TokenBucket(1e9, 1e9)
+
+    conn = sqlite3.connect(db_path)
+    sql.migrate(conn)
+    conn.close()
+    if spec.get("seed_ads"):
+        seed_ads(db_path, rng, spec["seed_ads"])
+    if spec.get("photos") and write_photos(workdir, spec["photos"], rng):
+        photos.set_source(photos.LocalPhotoSource(workdir))
+
+    queries = [0]
+
+    def count_query(statement):
+        queries[0] += 1
+
+    # Запросы считаются на всех соединениях хранилища, включая соединения для чтения
+    connect = storage._connect
+
+    def traced_connect(*connect_args, **connect_kwargs):
+        conn = connect(*connect_args, **connect_kwargs)
+        conn.set_trace_callback(count_query)
+        return conn
+
+    storage._connect = traced_connect
+
+    since = int(time.time()) - near_duplicates.WINDOW_SECONDS
+    near_duplicates.indexes.by_chat = near_duplicates.build_indexes(await storage.get_ads_since(since))
+    photos.indexes.by_chat = photos.build_indexes(await storage.get_photo_hashes_since(since))
+
+    latencies = []
+    message_ids = iter(range(1, 10 ** 9))
+
+    async def timed(coro):
+        started = time.perf_counter()
+        await coro
+        latencies.append(time.perf_counter() - started)
+
+    # Прогрев, как при запуске бота: numpy/sklearn загружаются во все процессы пула проверок
+    await workers.warmup(similarity.load)
+    await handlers.handle_group_message(make_message(config.bot, next(message_ids), 1, 0, random_ad(rng)))
+    queries[0] = 0
+    metrics.reset()
+
+    started = time.perf_counter()
+    messages = spec["messages"]
+    chats = spec.get("chats") or [GROUP_ID] * len(messages)
+    for offset in range(0, len(messages), spec["concurrency"]):
+        batch = zip(messages[offset:offset + spec["concurrency"]], chats[offset:offset + spec["concurrency"]])
+        await asyncio.gather(*(
+            timed(handlers.handle_group_message(
+                make_message(config.bot, next(message_ids), user_id, thread_id, text, photo, chat_id=chat_id)
+            ))
+            for (user_id, thread_id, text, photo), chat_id in batch
+        ))
+
+    for i in range(spec.get("admin", 0)):
+        command = rng.choice(["/topics", "/admin", "/sdays 2 7", "/cwarn 2 3", "/btime 2 5", "/switch 3"])
+        handler = {
+            "/topics": handlers.list_topics, "/admin": handlers.admin_panel, "/sdays": handlers.set_ad_frequency,
+            "/cwarn": handlers.set_warnings_limit_handler, "/btime": handlers.set_block_time_handler,
+            "/switch": handlers.switch_topic_handler,
+        }[command.split()[0]]
+        await storage.ensure_topic_exists(GROUP_ID, 2)
+        await storage.ensure_topic_exists(GROUP_ID, 3)
+        await timed(handler(make_message(
+            config.bot, next(message_ids), ADMIN_ID, 0, command, chat_id=ADMIN_ID, chat_type="private"
+        )))
+    elapsed = time.perf_counter() - started
+
+    await outbox.close()
+    if workers._executor is not None:
+        # Дожидаемся завершения процессов пула, чтобы их память попала в RUSAGE_CHILDREN
+        workers._executor.shutdown(wait=True)
+    workers.shutdown()
+    await storage.close()
+    handled = len(latencies)
+    return {
+        "scenario": name,
+        "messages": handled,
+        "concurrency": spec["concurrency"],
+        "seconds": round(elapsed, 4),
+        "messages_per_second": round(handled / elapsed, 2) if elapsed else 0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+            "max": round(max(latencies, default=0) * 1000, 3),
+        },
+        "db_queries_per_message": round(queries[0] / handled, 2) if handled else 0,
+        "api_requests": config.bot.requests,
+        "stages_ms": {
+            name: {"count": h.count, "p50": round(h.quantile(0.5) * 1000, 3), "p95": round(h.quantile(0.95) * 1000, 3)}
+            for name, h in sorted(metrics.histograms.items())
+        },
+        "counters": dict(metrics.counters),
+        "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Бенчмарк обработки сообщений")
+    parser.add_argument("scenarios", nargs="*", help=f"сценарии (по умолчанию все): {', '.join(SCENARIOS)}")
+    parser.add_argument("--size", type=int, default=500, help="сообщений в сценарии")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--executor", choices=["process", "thread"], default="process")
+    parser.add_argument("--workers", type=int, default=2, help="размер пула проверок")
+    parser.add_argument("--api-latency", type=float, default=0.0, help="задержка ответа Telegram, сек.")
+    parser.add_argument("--sqlite-profile", choices=["wal", "default"], default="wal", help="профиль SQLite (storage)")
+    parser.add_argument("--output", help="файл для результатов в JSON")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    return parser
+
+
+def main():
+    parser = make_parser()
+    args = parser.parse_args()
+
+    if args.child:
+        # Дочерний процесс: один сценарий, результат — JSON в stdout
+        result = asyncio.run(run_scenario(args.child, args))
+        result["peak_rss_children_kb"] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        sys.stdout = sys.__stdout__
+        print("RESULT " + json.dumps(result))
+        return
+
+    names = args.scenarios or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(unknown)}")
+
+    results = []
+    for name in names:
+        command = [sys.executable, os.path.abspath(__file__), "--child", name, "--size", str(args.size),
+                   "--seed", str(args.seed), "--executor", args.executor, "--workers", str(args.workers),
+                   "--api-latency", str(args.api_latency), "--sqlite-profile", args.sqlite_profile]
+        completed = subprocess.run(command, cwd=ROOT, capture_output=True, text=True)
+        lines = [line for line in completed.stdout.splitlines() if line.startswith("RESULT ")]
+        if completed.returncode != 0 or not lines:
+            print(f"{name}: ошибка\n{completed.stderr}", file=sys.stderr)
+            continue
+        result = json.loads(lines[-1][len("RESULT "):])
+        results.append(result)
+        latency = result["latency_ms"]
+        print(
+            f"{name:14} {result['messages']:6} сообщ. {result['messages_per_second']:9.1f}/с  "
+            f"p50 {latency['p50']:8.2f} мс  p95 {latency['p95']:8.2f} мс  p99 {latency['p99']:8.2f} мс  "
+            f"запросов к БД {result['db_queries_per_message']:6.2f}/сообщ.  "
+            f"RSS {result['peak_rss_kb'] / 1024:.0f} МБ (+{result['peak_rss_children_kb'] / 1024:.0f} МБ пул)"
+        )
+
+    commit = git_commit()
+    output = args.output or os.path.join(ROOT, "bench", "results", f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump({
+            "commit": commit,
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "settings": {"size": args.size, "seed": args.seed, "executor": args.executor,
+                         "workers": args.workers, "api_latency": args.api_latency,
+                         "sqlite_profile": args.sqlite_profile},
+            "results": results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"Результаты записаны в {output}")
+
+
+if __name__ == "__mp_main__":
+    # Процессы пула проверок запускаются через spawn и заново импортируют этот файл (как __mp_main__)
+    # с аргументами процесса сценария; вместо config.py им нужны те же настройки бенчмарка
+    install_config("", make_parser().parse_args())
+
+if __name__ == "__main__":
+    main()
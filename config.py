@@ -6,3 +6,54 @@ DB_PATH = "YOUR:/DB/PATH" (str)
 
 ADMIN_IDS = ['ADMIN-ID', 'ADMIN-ID-2'] # @username_to_id_bot в телеграме (str)
 GROUP_ID = -123456789 # @username_to_id_bot в телеграме (int)
+# Дополнительные группы: ID группы -> ID её администраторов (в дополнение к ADMIN_IDS, которые управляют
+# всеми группами). GROUP_ID модерируется всегда, его собственных администраторов тоже можно указать здесь.
+# Пример: {-100111: ['ADMIN-ID-3'], -100222: []} (dict)
+GROUPS = {}
+
+# Пул для тяжёлых проверок (схожесть текстов, хэши фото)
+CHECK_EXECUTOR = "process"  # "process" — отдельные процессы, "thread" — потоки (str)
+CHECK_WORKERS = 2  # количество процессов/потоков (int)
+CHECK_QUEUE_SIZE = 100  # максимум проверок в работе и в очереди одновременно (int)
+CHECK_TIMEOUT = 5  # максимальное время одной проверки вместе с ожиданием в очереди, сек. (int)
+
+RESTORE_PERMISSIONS_ON_BAN_EXPIRY = True  # по истечении блокировки явно вернуть права, как при /unban (bool)
+
+PROMETHEUS_PORT = 0  # порт для метрик в формате Prometheus на 127.0.0.1 (/metrics), 0 — выключено (int)
+
+# Вебхук вместо long polling. Пустой WEBHOOK_URL — long polling
+WEBHOOK_URL = ""  # публичный адрес вебхука, например https://bot.example.com/webhook (str)
+WEBHOOK_SECRET = ""  # секрет, который Telegram передаёт в заголовке X-Telegram-Bot-Api-Secret-Token; пустой — случайный при каждом запуске (str)
+WEBHOOK_HOST = "0.0.0.0"  # адрес, на котором слушает HTTP-сервер (str)
+WEBHOOK_PORT = 8080  # порт HTTP-сервера (int)
+WEBHOOK_PATH = "/webhook"  # путь, на который приходят обновления; /health — проверка состояния (str)
+UPDATE_QUEUE_SIZE = 1000  # максимум принятых, но ещё не обработанных обновлений (int)
+UPDATE_WORKERS = 8  # сколько обновлений обрабатывается одновременно (int)
+
+# Профиль SQLite: "wal" — журнал WAL, чтение через отдельные соединения параллельно с записью,
+# mmap и увеличенный кэш страниц; "default" — настройки sqlite3 по умолчанию, одно соединение (str)
+SQLITE_PROFILE = "wal"
+SQLITE_READERS = 4  # потоков с соединениями только для чтения (int)
+SQLITE_MMAP_SIZE_MB = 256  # сколько файла БД читать через mmap, МБ (int)
+SQLITE_CACHE_SIZE_MB = 64  # кэш страниц каждого соединения, МБ (int)
+SQLITE_CHECKPOINT_SECONDS = 60  # как часто переносить WAL в файл БД, 0 — автоматически средствами SQLite (int)
+SQLITE_INTEGRITY_CHECK = "quick"  # проверка БД при запуске: "quick", "full" или "off" (str)
+
+# Упрощённые проверки при перегрузке (app/load.py). Задержка — сколько прошло от отправки сообщения до его проверки
+LOAD_EXACT_BACKLOG = 50  # сообщений в обработке, начиная с которого проверяются только точные повторы (int)
+LOAD_EXACT_DELAY = 10  # задержка, начиная с которой проверяются только точные повторы, сек. (int)
+LOAD_FLOOD_BACKLOG = 200  # сообщений в обработке, начиная с которого действует только лимит сообщений (int)
+LOAD_FLOOD_DELAY = 30  # задержка, начиная с которой действует только лимит сообщений, сек. (int)
+FLOOD_LIMIT = 5  # больше стольких сообщений одного пользователя за FLOOD_WINDOW_SECONDS удаляются (int)
+FLOOD_WINDOW_SECONDS = 60  # окно лимита сообщений, сек. (int)
+
+# При блокировке удалять сообщения пользователя с объявлениями за последние столько часов,
+# 0 — не удалять; Telegram позволяет боту удалять только сообщения не старше 48 часов (int)
+PURGE_ON_BAN_HOURS = 24
+
+# Журнал (app/logs.py): консоль и файл с записями в JSON
+LOG_LEVEL = "INFO"  # DEBUG — ещё и запись о каждом проверенном сообщении, с выборкой LOG_DEBUG_SAMPLE_RATE (str)
+LOG_FILE = "bot.log"  # файл журнала, ротируется по размеру; "" — только консоль (str)
+LOG_MAX_BYTES = 10 * 1024 * 1024  # размер файла журнала, после которого начинается новый (int)
+LOG_BACKUP_COUNT = 5  # сколько старых файлов журнала хранить (int)
+LOG_DEBUG_SAMPLE_RATE = 0.01  # доля записей DEBUG, которые попадают в журнал (float)
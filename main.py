@@ -1,20 +1,114 @@
-import subprocess
+import time
+# Отсчёт времени запуска до импорта тяжёлых модулей
+PROCESS_STARTED = time.perf_counter()
+
 import asyncio
-from config import bot
+import logging
+import sqlite3
+from config import bot, DB_PATH, PROMETHEUS_PORT, WEBHOOK_URL
 from aiogram import Dispatcher
 
-from app.handlers import router
+import sql
+from app.handlers import router, lift_expired_ban, recheck_message
+from app import storage, similarity, near_duplicates, photos, workers, outbox, janitor, bans, metrics, load, logs
+
+logger = logging.getLogger(__name__)
 
 dp = Dispatcher()
 
+# Время этапов запуска (этап, секунды) — выводится одной строкой перед началом опроса
+startup_timings = []
+
+
+def mark_stage(stage: str, started: float) -> float:
+    now = time.perf_counter()
+    startup_timings.append((stage, now - started))
+    return now
+
+
+def init_schema():
+    conn = sqlite3.connect(DB_PATH)
+    try:
+        sql.migrate(conn)
+    finally:
+        conn.close()
+
+
+def check_database():
+    problems = storage.check_integrity()
+    if problems:
+        # Продолжать работу с повреждённой БД нельзя: восстановите её из копии (.recover в sqlite3)
+        raise SystemExit("БД повреждена: " + "; ".join(problems[:10]))
+
+
+async def load_indexes():
+    """Строит индексы одинаковых объявлений и фото в фоне, пока бот уже принимает сообщения.
+       Готовый индекс подменяет пустой целиком; объявления, добавленные за время построения, переносятся в него."""
+    started = time.perf_counter()
+    since = int(time.time()) - near_duplicates.WINDOW_SECONDS
+    added = near_duplicates.indexes.start_rebuild()
+    ads = await storage.get_ads_since(since)
+    near_duplicates.indexes.finish_rebuild(await asyncio.to_thread(near_duplicates.build_indexes, ads), added)
+    added = photos.indexes.start_rebuild()
+    photo_rows = await storage.get_photo_hashes_since(since)
+    photos.indexes.finish_rebuild(await asyncio.to_thread(photos.build_indexes, photo_rows), added)
+    await storage.load_text_filters(int(time.time()) - await storage.max_ad_frequency_days() * 24 * 60 * 60)
+    logger.info(
+        "Индексы объявлений загружены за %.2f с (групп: %s, текстов: %s, фото: %s)",
+        time.perf_counter() - started, len(near_duplicates.indexes), near_duplicates.size(), photos.size()
+    )
+
+
 async def main():
+    started = mark_stage("импорт модулей", PROCESS_STARTED)
+    init_schema()
+    started = mark_stage("схема БД", started)
+    check_database()
+    started = mark_stage("проверка БД", started)
     dp.include_router(router)
-    await dp.start_polling(bot)
-    
+    await bans.start(lift_expired_ban)
+    started = mark_stage("блокировки", started)
+    photos.set_source(photos.TelegramPhotoSource(bot))
+    metrics_server = await metrics.start_server(PROMETHEUS_PORT) if PROMETHEUS_PORT else None
+
+    # Тяжёлые библиотеки и индексы загружаются в фоне, опрос начинается сразу
+    background = [
+        asyncio.create_task(workers.warmup(similarity.load)),
+        asyncio.create_task(load_indexes()),
+        asyncio.create_task(janitor.run_forever()),
+        asyncio.create_task(janitor.checkpoint_forever()),
+        load.start(recheck_message),
+    ]
+    mark_stage("запуск фоновых задач", started)
+    logger.info("Время запуска: " + ", ".join(f"{stage} {seconds:.3f} с" for stage, seconds in startup_timings)
+                + f"; всего {sum(seconds for _, seconds in startup_timings):.3f} с")
+    try:
+        if WEBHOOK_URL:
+            from app import webhook
+            await webhook.serve(dp, bot)
+        else:
+            # Если раньше был установлен вебхук, long polling с ним не работает
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        for task in background:
+            task.cancel()
+        if metrics_server is not None:
+            await metrics_server.cleanup()
+        bans.stop()
+        await outbox.close()
+        # start_polling закрывает сессию сам, но до отправки очереди outbox; в режиме вебхука — никто
+        await bot.session.close()
+        workers.shutdown()
+        await storage.close()
+
 # Точка входа, запуск только этого файла
 if __name__ == '__main__':
-    subprocess.run(["python", "sql.py"])
+    # Журнал настраивается до запуска, чтобы в него попали и миграции схемы БД
+    logs.setup()
     try:
         asyncio.run(main())
     except KeyboardInterrupt:
         print('Exit')
+    finally:
+        logs.stop()
@@ -1,51 +1,245 @@
+import logging
 import sqlite3
-from config import DB_PATH
-
-conn = sqlite3.connect(DB_PATH)
-cursor = conn.cursor()
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS ads (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER,
-    thread_id INTEGER,
-    text TEXT,
-    photo_id TEXT,
-    timestamp INTEGER
-)
-""")
-
-# Таблица для предупреждений с колонкой ad_key
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS warnings (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER,
-    ad_key TEXT,
-    warning_count INTEGER,
-    last_warning INTEGER
-)
-""")
-
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS topics (
-    thread_id INTEGER PRIMARY KEY,
-    enabled INTEGER DEFAULT 1,
-    block_days INTEGER DEFAULT 5,
-    warnings_limit INTEGER DEFAULT 3,
-    ad_frequency_days INTEGER DEFAULT 5
-)
-""")
-
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS bans (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    user_id INTEGER,
-    first_name TEXT,
-    banned_until INTEGER,
-    reason TEXT DEFAULT 'Не указано'
-)
-""")
-
-conn.commit()
-conn.close()
+import sys
+import time
+from config import DB_PATH, GROUP_ID
+from app.hashing import text_hash, text_key
+
+logger = logging.getLogger(__name__)
+
+
+def _hash_ad_texts(conn: sqlite3.Connection):
+    """Считает text_hash существующих объявлений и переводит ключи предупреждений с текста на хэш."""
+    rows = conn.execute("SELECT id, text FROM ads WHERE text != ''").fetchall()
+    conn.executemany("UPDATE ads SET text_hash=? WHERE id=?", [(text_hash(text), ad_id) for ad_id, text in rows])
+    # Ключ предупреждения — либо текст, либо photo_id; фото оставляем как есть
+    photo_ids = {row[0] for row in conn.execute("SELECT DISTINCT photo_id FROM ads WHERE photo_id != ''")}
+    warnings = conn.execute("SELECT id, ad_key FROM warnings").fetchall()
+    conn.executemany(
+        "UPDATE OR REPLACE warnings SET ad_key=? WHERE id=?",
+        [(text_key(ad_key), warning_id) for warning_id, ad_key in warnings if ad_key not in photo_ids]
+    )
+
+
+# Миграции схемы БД: (версия, описание, список шагов). Шаг — SQL-команда или функция,
+# которой передаётся соединение (для преобразования данных в Python).
+# Каждая миграция выполняется в отдельной транзакции, номер последней
+# применённой версии хранится в таблице schema_version.
+# Новые изменения схемы добавляются только в конец списка.
+MIGRATIONS = [
+    (1, "Начальная схема", [
+        """
+        CREATE TABLE IF NOT EXISTS ads (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            thread_id INTEGER,
+            text TEXT,
+            photo_id TEXT,
+            timestamp INTEGER
+        )
+        """,
+        # Таблица для предупреждений с колонкой ad_key
+        """
+        CREATE TABLE IF NOT EXISTS warnings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            ad_key TEXT,
+            warning_count INTEGER,
+            last_warning INTEGER
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS topics (
+            thread_id INTEGER PRIMARY KEY,
+            enabled INTEGER DEFAULT 1,
+            block_days INTEGER DEFAULT 5,
+            warnings_limit INTEGER DEFAULT 3,
+            ad_frequency_days INTEGER DEFAULT 5
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS bans (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            first_name TEXT,
+            banned_until INTEGER,
+            reason TEXT DEFAULT 'Не указано'
+        )
+        """,
+    ]),
+    (2, "Индексы для поиска объявлений и уникальный ключ предупреждений", [
+        # Пересоздаём warnings с UNIQUE(user_id, ad_key), схлопывая возможные дубликаты
+        """
+        CREATE TABLE warnings_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            ad_key TEXT NOT NULL,
+            warning_count INTEGER NOT NULL DEFAULT 0,
+            last_warning INTEGER,
+            UNIQUE (user_id, ad_key)
+        )
+        """,
+        """
+        INSERT INTO warnings_new (user_id, ad_key, warning_count, last_warning)
+        SELECT user_id, ad_key, MAX(warning_count), MAX(last_warning)
+        FROM warnings
+        WHERE user_id IS NOT NULL AND ad_key IS NOT NULL
+        GROUP BY user_id, ad_key
+        """,
+        "DROP TABLE warnings",
+        "ALTER TABLE warnings_new RENAME TO warnings",
+        # Выборка объявлений пользователя за период (storage.get_recent_ads)
+        "CREATE INDEX IF NOT EXISTS idx_ads_user_time ON ads (user_id, timestamp)",
+        # Поиск повторов по фото и по тексту (storage.get_ad_record);
+        # thread_id в конце делает индексы покрывающими для этих запросов
+        "CREATE INDEX IF NOT EXISTS idx_ads_user_photo ON ads (user_id, photo_id, timestamp, thread_id)",
+        "CREATE INDEX IF NOT EXISTS idx_ads_user_text ON ads (user_id, text, timestamp, thread_id)",
+        "CREATE INDEX IF NOT EXISTS idx_bans_user ON bans (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_bans_until ON bans (banned_until)",
+    ]),
+    (3, "Сохранённые векторы текста объявлений", [
+        # Частоты слов нормализованного текста (app/similarity.py, vectorize)
+        "ALTER TABLE ads ADD COLUMN features BLOB",
+    ]),
+    (4, "Поиск одинаковых объявлений разных пользователей", [
+        # Действие при совпадении с объявлением другого пользователя: notify, warn или off
+        "ALTER TABLE topics ADD COLUMN cross_user_action TEXT DEFAULT 'notify'",
+        # Загрузка объявлений всех пользователей за период (storage.get_ads_since)
+        "CREATE INDEX IF NOT EXISTS idx_ads_time ON ads (timestamp)",
+    ]),
+    (5, "Перцептивные хэши фото", [
+        # dHash фото (app/photos.py); photo_id для новых записей — file_unique_id
+        "ALTER TABLE ads ADD COLUMN photo_hash INTEGER",
+    ]),
+    (6, "Несколько групп", [
+        # Все записи, сохранённые до этой версии, относятся к группе GROUP_ID
+        f"ALTER TABLE ads ADD COLUMN chat_id INTEGER NOT NULL DEFAULT {int(GROUP_ID)}",
+        f"ALTER TABLE bans ADD COLUMN chat_id INTEGER NOT NULL DEFAULT {int(GROUP_ID)}",
+        """
+        CREATE TABLE warnings_new (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            ad_key TEXT NOT NULL,
+            warning_count INTEGER NOT NULL DEFAULT 0,
+            last_warning INTEGER,
+            UNIQUE (chat_id, user_id, ad_key)
+        )
+        """,
+        f"""
+        INSERT INTO warnings_new (chat_id, user_id, ad_key, warning_count, last_warning)
+        SELECT {int(GROUP_ID)}, user_id, ad_key, warning_count, last_warning FROM warnings
+        """,
+        "DROP TABLE warnings",
+        "ALTER TABLE warnings_new RENAME TO warnings",
+        # Настройки тем хранятся отдельно для каждой группы
+        """
+        CREATE TABLE topics_new (
+            chat_id INTEGER NOT NULL,
+            thread_id INTEGER NOT NULL,
+            enabled INTEGER DEFAULT 1,
+            block_days INTEGER DEFAULT 5,
+            warnings_limit INTEGER DEFAULT 3,
+            ad_frequency_days INTEGER DEFAULT 5,
+            cross_user_action TEXT DEFAULT 'notify',
+            PRIMARY KEY (chat_id, thread_id)
+        )
+        """,
+        f"""
+        INSERT INTO topics_new (chat_id, thread_id, enabled, block_days, warnings_limit, ad_frequency_days, cross_user_action)
+        SELECT {int(GROUP_ID)}, thread_id, enabled, block_days, warnings_limit, ad_frequency_days, cross_user_action FROM topics
+        """,
+        "DROP TABLE topics",
+        "ALTER TABLE topics_new RENAME TO topics",
+        # Индексы объявлений и блокировок с группой в начале ключа
+        "DROP INDEX IF EXISTS idx_ads_user_time",
+        "DROP INDEX IF EXISTS idx_ads_user_photo",
+        "DROP INDEX IF EXISTS idx_ads_user_text",
+        "DROP INDEX IF EXISTS idx_bans_user",
+        "CREATE INDEX IF NOT EXISTS idx_ads_chat_user_time ON ads (chat_id, user_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_ads_chat_user_photo ON ads (chat_id, user_id, photo_id, timestamp, thread_id)",
+        "CREATE INDEX IF NOT EXISTS idx_ads_chat_user_text ON ads (chat_id, user_id, text, timestamp, thread_id)",
+        "CREATE INDEX IF NOT EXISTS idx_bans_chat_user ON bans (chat_id, user_id)",
+    ]),
+    (7, "Хэш текста объявлений", [
+        # 64-битный хэш нормализованного текста (app/hashing.py): по нему ищутся точные повторы,
+        # строковое представление — ключ предупреждений вместо полного текста
+        "ALTER TABLE ads ADD COLUMN text_hash INTEGER",
+        _hash_ad_texts,
+        "DROP INDEX IF EXISTS idx_ads_chat_user_text",
+        "CREATE INDEX IF NOT EXISTS idx_ads_chat_user_hash ON ads (chat_id, user_id, text_hash, timestamp, thread_id)",
+    ]),
+    (8, "ID сообщений объявлений", [
+        # Для удаления недавних сообщений заблокированного пользователя (bans.purge_messages);
+        # у объявлений, сохранённых до этой версии, ID нет
+        "ALTER TABLE ads ADD COLUMN message_id INTEGER",
+    ]),
+]
+
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    cursor = conn.execute("SELECT MAX(version) FROM schema_version")
+    result = cursor.fetchone()
+    return result[0] if result and result[0] is not None else 0
+
+
+def migrate(conn: sqlite3.Connection) -> int:
+    """Применяет к БД все недостающие миграции и возвращает итоговую версию схемы.
+       Существующие базы обновляются на месте, уже применённые миграции пропускаются."""
+    if conn.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0:
+        # Новая БД сразу создаётся с incremental vacuum; существующую переводит enable_incremental_vacuum
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at INTEGER
+    )
+    """)
+    conn.commit()
+
+    current_version = get_schema_version(conn)
+    for version, description, statements in MIGRATIONS:
+        if version <= current_version:
+            continue
+        try:
+            conn.execute("BEGIN")
+            for statement in statements:
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (version, description, int(time.time()))
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        current_version = version
+        logger.info("Схема БД обновлена до версии %s: %s", version, description)
+    return current_version
+
+
+def enable_incremental_vacuum(conn: sqlite3.Connection):
+    """Переводит существующую БД в режим auto_vacuum = INCREMENTAL, в котором очистка возвращает
+       освободившееся место файлу. Режим включается только полной перестройкой файла (VACUUM):
+       на большой БД это долго и требует свободного места размером с БД, поэтому выполняется
+       вручную при остановленном боте: python sql.py vacuum"""
+    if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+        logger.info("Режим incremental vacuum уже включён")
+        return
+    started = time.perf_counter()
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    logger.info("Режим incremental vacuum включён за %.1f с", time.perf_counter() - started)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+    conn = sqlite3.connect(DB_PATH)
+    migrate(conn)
+    if sys.argv[1:] == ["vacuum"]:
+        enable_incremental_vacuum(conn)
+    conn.close()